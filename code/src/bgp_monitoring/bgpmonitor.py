@@ -1,14 +1,36 @@
 import argparse
 import appdirs
 import arrow
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+import hashlib
+import itertools
 import pickle
-import pybgpstream
 import os
-
-FILTER = 'prefix more {}'
-
-class BGPMonitor(object):
+import sys
+import time
+import ujson
+
+import bgpstore
+from pathdict import PathDict
+from statelog import StateLog
+from convergence import ConvergenceDelays, merge_delays, sketch_delays, sketches_fname, write_delays
+from pathhunting import PathHunting
+from roaschedule import ROASchedule
+from events import ReachabilityEvents
+from updatesource import BGPStreamSource, MRTReplaySource, RISLiveSource, Update
+
+SNAPSHOT_INTERVAL = 1000 # keep a full copy of the monitors state every N log entries
+CHECKPOINT_FNAME = 'checkpoint.pickle'
+MAX_WARNINGS = 10 # maximum number of warnings printed for paths without upstream
+RIS_COLLECTORS = [
+        'rrc00', 'rrc01', 'rrc03', 'rrc04', 'rrc05', 'rrc06', 'rrc07', 'rrc10',
+        'rrc11', 'rrc12', 'rrc13', 'rrc14', 'rrc15', 'rrc16', 'rrc18', 'rrc19',
+        'rrc20', 'rrc21', 'rrc22', 'rrc23', 'rrc24', 'rrc25', 'rrc26'
+        ]
+
+class BGPMonitor(StateLog):
     def __init__(self, prefix_list, starttime, endtime, my_asns):
         """Initialize BGP monitors for the given list of prefixes.
 
@@ -20,14 +42,17 @@ class BGPMonitor(object):
         """
 
         self.prefix_list = prefix_list
-        self.my_asns = my_asns
+        self.my_asns = [int(asn) for asn in my_asns]
+        # AS paths are stored as IDs referencing this dictionary
+        self.paths = PathDict()
         self.monitors = { prefix.lower():{} for prefix in prefix_list}
         self.log_data = { 
             prefix: {
                 'time': [],
                 'reachability': [],
                 'upstream': [],
-                'aspath': []
+                'delta': [],
+                'snapshot': {}
             } 
             for prefix in prefix_list }
 
@@ -36,19 +61,62 @@ class BGPMonitor(object):
 
         self.cachedir = appdirs.user_cache_dir('rov-timing', 'IHR')+'/mrt'
         os.makedirs(self.cachedir, exist_ok=True)
-
+        # RIB entries for monitored prefixes
+        self.ribcachedir = appdirs.user_cache_dir('rov-timing', 'IHR')+'/ribs'
+        os.makedirs(self.ribcachedir, exist_ok=True)
+
+        # number of BGP messages read
+        self.nb_updates = 0
+        # set when monitors are restored from a checkpoint
+        self.resumed = False
+        # notified of each change (see add_operator)
+        self.operators = []
+
+        # Upstream of each path ID (computed once per path), and number of 
+        # routers using each upstream/peer AS for each prefix, updated at each
+        # change
+        self.path_upstream = {}
+        self.upstream_counts = { prefix: Counter() for prefix in self.monitors }
+        self.peer_counts = { prefix: Counter() for prefix in self.monitors }
+        self.nb_no_upstream = 0
+
+    def checkpoint(self):
+        """Return the state needed to resume monitoring after self.endtime"""
+
+        return {
+                'prefix_list': self.prefix_list,
+                'my_asns': self.my_asns,
+                'endtime': self.endtime.isoformat(),
+                'monitors': self.monitors,
+                'paths': self.paths,
+                }
+
+    @classmethod
+    def resume(cls, checkpoint, endtime):
+        """Create a BGPMonitor starting where the given checkpoint ended. Path
+        IDs are the same as in the checkpointed logs."""
+
+        bm = cls(checkpoint['prefix_list'], checkpoint['endtime'], endtime, checkpoint['my_asns'])
+        bm.monitors = checkpoint['monitors']
+        bm.paths = checkpoint['paths']
+        bm.resumed = True
+        bm.recount()
+
+        return bm
 
     def fetch_data(self, collector='rrc00'):
 
-        print('reading ribs..')
-        bm.read_rib(collector)
+        # Monitors are already bootstrapped when resuming from a checkpoint
+        if not self.resumed:
+            print(f'{collector}: reading ribs..')
+            self.read_rib(collector)
 
         # Log state at the begining of the mesurement period
         for prefix in self.prefix_list:
             self.log_state(prefix, self.starttime)
 
-        print('reading updates..')
-        bm.read_updates(collector)
+        print(f'{collector}: reading updates..')
+        self.read_updates(collector)
 
         # Log state at the end of the mesurement period
         for prefix in self.prefix_list:
@@ -56,68 +124,190 @@ class BGPMonitor(object):
 
 
     def read_rib(self, collector='rrc00'):
-        """Read a RIB to bootstrap the monitoring process"""
-
-        start = self.starttime.shift(hours=-1)
-        end = self.starttime.shift(hours=1)
-        stream = pybgpstream.BGPStream(
-            from_time=int(start.timestamp()), until_time=int(end.timestamp()),
-            record_type="ribs", collector=collector,
-        )
-        stream.set_data_interface_option("broker", "cache-dir", self.cachedir)
-
-        # Filter for given prefixes
-        for prefix in self.prefix_list:
-            stream.stream.parse_filter_string(FILTER.format(prefix))
+        """Read the RIB dump preceding starttime to bootstrap the monitoring 
+        process, updates between the dump and starttime are applied without
+        being logged. RIB entries for the monitored prefixes are cached so next
+        runs (or shards) starting from the same RIB don't read it again."""
+
+        hours = rib_period(collector)
+        rib_ts = rib_time(self.starttime, hours)
+
+        prefixes_hash = hashlib.sha1(','.join(sorted(self.prefix_list)).encode()).hexdigest()[:16]
+        cache_fname = os.path.join(self.ribcachedir, 
+                f'{collector}_{int(rib_ts.timestamp())}_{prefixes_hash}.json')
+
+        if os.path.exists(cache_fname):
+            with open(cache_fname) as fp:
+                entries = ujson.load(fp)
+        else:
+            # Only the dump starting at rib_ts
+            source = BGPStreamSource(self.prefix_list, rib_ts, rib_ts, collector,
+                record_type='ribs', cachedir=self.cachedir)
+            entries = [ [update.prefix, update.peer_address, update.aspath] for update in source ]
+
+            # Don't cache missing RIBs, they may not be archived yet
+            if entries:
+                tmp_fname = f'{cache_fname}.{os.getpid()}'
+                with open(tmp_fname, 'w') as fp:
+                    ujson.dump(entries, fp)
+                os.replace(tmp_fname, cache_fname)
+
+        self.bootstrap( Update(rib_ts.timestamp(), 'R', prefix, router, aspath) 
+                for prefix, router, aspath in entries )
+
+        if rib_ts < self.starttime:
+            self.bootstrap( update for update in BGPStreamSource(self.prefix_list, 
+                rib_ts, self.starttime, collector, cachedir=self.cachedir)
+                if update.time < self.starttime.timestamp() )
+
+    def bootstrap(self, source):
+        """Set the monitors state from the RIB entries (or updates) given by 
+        source, changes are not logged"""
+
+        for update in source:
+            if update.prefix not in self.monitors:
+                continue
 
-        for elem in stream:
-            # Extract the prefix and origin ASN
-            msg = elem.fields
-            prefix = msg['prefix']
-            router = elem.peer_address
-            self.monitors[prefix][router] = msg['as-path'].split(' ')
+            router = sys.intern(update.peer_address)
+            path_id = None if update.type == 'W' else self.paths.intern(update.aspath)
+            self.set_route(update.prefix, router, path_id)
 
     def read_updates(self, collector='rrc00' ):
         """Read update messages and plot reachability over time."""
 
-        stream = pybgpstream.BGPStream(
-            from_time=int(self.starttime.timestamp()), 
-            until_time=int(self.endtime.timestamp()),
-            record_type="updates", collector=collector,
-        )
-        stream.set_data_interface_option("broker", "cache-dir", self.cachedir)
+        self.run( BGPStreamSource(self.prefix_list, self.starttime, self.endtime, 
+            collector, cachedir=self.cachedir) )
 
-        # Filter for given prefixes
-        for prefix in self.prefix_list:
-            stream.stream.parse_filter_string(FILTER.format(prefix))
+    def add_operator(self, operator):
+        """Register an operator that is notified of all changes of the monitors
+        state. Operators implement:
+            update(bm, prefix, router, timestamp, old_path, new_path): called 
+            after each change, paths are path IDs or None if there is no route.
+            tick(bm, timestamp): called after each update read or when a live 
+            source is idle.
+        """
 
-        for elem in stream:
-            # Update routers state
-            msg = elem.fields
-            prefix = msg['prefix']
-            router = elem.peer_address
+        self.operators.append(operator)
 
-            # Log new state only if it really changed
-            log = False
+    def run(self, source):
+        """Update monitors with all updates given by source, an iterable of
+        updatesource.Update (see updatesource.BGPStreamSource)."""
 
-            if elem.type == 'W':
-                if router in self.monitors[prefix]:
-                    del self.monitors[prefix][router] 
-                    log = True
+        for update in source:
+            if update is None:
+                # Idle live source
+                timestamp = time.time()
             else:
-                current_aspath = None
-                if router in self.monitors[prefix]:
-                    current_aspath = ' '.join(self.monitors[prefix][router])
-                if current_aspath != msg['as-path'] or current_aspath is None:
-                    self.monitors[prefix][router] = msg['as-path'].split(' ') 
-                    log = True
+                self.process_update(update)
+                timestamp = update.time
+
+            for operator in self.operators:
+                operator.tick(self, timestamp)
+
+    def process_update(self, update):
+        """Update the monitors state with the given update. Returns True if the 
+        state changed."""
+
+        self.nb_updates += 1
+
+        # Update routers state
+        prefix = update.prefix
+        if prefix not in self.monitors:
+            return False
+        router = sys.intern(update.peer_address)
+        old_path = self.monitors[prefix].get(router)
+
+        if update.type == 'W':
+            new_path = None
+        else:
+            new_path = self.paths.intern(update.aspath)
+
+        if old_path == new_path:
+            return False
+        self.set_route(prefix, router, new_path)
+
+        # Log new state only if it really changed
+        self.log_state(prefix, update.time, (router, new_path))
+
+        for operator in self.operators:
+            operator.update(self, prefix, router, update.time, old_path, new_path)
+
+        return True
+
+    def set_route(self, prefix, router, path_id):
+        """Set the path used by the router for the given prefix (None for 
+        withdraws) and update upstream/peer counters."""
+
+        old_path = self.monitors[prefix].get(router)
+        if old_path is not None:
+            self._count_path(prefix, old_path, -1)
+
+        if path_id is None:
+            self.monitors[prefix].pop(router, None)
+        else:
+            self.monitors[prefix][router] = path_id
+            self._count_path(prefix, path_id, 1)
+
+    def recount(self):
+        """Recompute upstream/peer counters from the monitors state"""
+
+        for prefix, routers in self.monitors.items():
+            self.upstream_counts[prefix] = Counter()
+            self.peer_counts[prefix] = Counter()
+            for path_id in routers.values():
+                self._count_path(prefix, path_id, 1)
+
+    def _count_path(self, prefix, path_id, increment):
+        """Add increment to the counters of the upstream and peer AS of 
+        the given path"""
+
+        upstream = self.get_upstream(path_id)
+        if upstream is not None:
+            self._increment(self.upstream_counts[prefix], upstream, increment)
+
+        self._increment(self.peer_counts[prefix], self.paths[path_id][0], increment)
+
+    @staticmethod
+    def _increment(counter, key, increment):
+        counter[key] += increment
+        if counter[key] == 0:
+            del counter[key]
+
+    def get_upstream(self, path_id):
+        """Return the upstream network of my_asns on the given path, None if 
+        my_asns are not on the path."""
+
+        if path_id in self.path_upstream:
+            return self.path_upstream[path_id]
+
+        aspath = self.paths[path_id]
+        my_asn = [asn for asn in self.my_asns if asn in aspath] 
+        if len(my_asn) == 0:
+            upstream = None
+            self.nb_no_upstream += 1
+            if self.nb_no_upstream <= MAX_WARNINGS:
+                print(f'Error! {self.my_asns} is not on the path: {self.paths.to_str(path_id)}')
+            if self.nb_no_upstream == MAX_WARNINGS:
+                print('Error! Too many paths without upstream, not reporting more')
+        else:
+            upstream = aspath[ aspath.index(my_asn[0]) - 1 ]
 
-            if log:
-                self.log_state(prefix, elem.time)
+        self.path_upstream[path_id] = upstream
+        return upstream
 
-    def log_state(self, prefix, timestamp):
+    def log_state(self, prefix, timestamp, delta=None):
         """Timestamp the current number of active monitors/upstreams for the 
-        given prefix."""
+        given prefix.
+
+        delta: the change that led to this state, (router, path ID) for an 
+        announcement or (router, None) for a withdraw. None if nothing changed.
+        """
+
+        # keep a full copy of the state from time to time, only the change 
+        # otherwise
+        if len(self.log_data[prefix]['time']) % SNAPSHOT_INTERVAL == 0:
+            self.log_data[prefix]['snapshot'][len(self.log_data[prefix]['time'])] = dict(self.monitors[prefix])
+        self.log_data[prefix]['delta'].append( delta )
 
         self.log_data[prefix]['time'].append( arrow.get(timestamp).datetime )
 
@@ -126,30 +316,354 @@ class BGPMonitor(object):
         self.log_data[prefix]['reachability'].append( nb_active )
 
         # keep track of upstream seen in AS paths
-        upstreams = defaultdict(int)
-        for aspath in self.monitors[prefix].values():
-            my_asn = [asn for asn in self.my_asns if asn in aspath] 
-            if len(my_asn) == 0:
-                print(f'Error! {self.my_asns} is not on the path for {prefix}: {aspath}')
-                continue
-
-            upstream = aspath[ aspath.index(my_asn[0]) - 1 ]
-            upstreams[upstream] += 1
-        self.log_data[prefix]['upstream'].append( upstreams )
-
-        # keep track of all AS paths
-        self.log_data[prefix]['aspath'].append( list(self.monitors[prefix].values()) )
+        self.log_data[prefix]['upstream'].append( dict(self.upstream_counts[prefix]) )
+
+    @classmethod
+    def stitch(cls, shards):
+        """Concatenate the logs of BGPMonitors covering consecutive periods of 
+        time (see rib_shards()). The first state of each shard is kept as a 
+        snapshot, differences with the last state of the previous shard are 
+        reported in boundary_diffs."""
+
+        shards = sorted(shards, key=lambda shard: shard.starttime)
+        first, last = shards[0], shards[-1]
+        bm = cls(first.prefix_list, first.starttime, last.endtime, first.my_asns)
+        # (time, prefix, number of routers with a different state)
+        bm.boundary_diffs = []
+
+        for shard_nb, shard in enumerate(shards):
+            bm.nb_updates += shard.nb_updates
+
+            # Map shard path IDs to the stitched path dictionary
+            path_ids = [ bm.paths.intern(shard.paths.to_str(path_id)) 
+                    for path_id in range(len(shard.paths)) ]
+            def remap(state):
+                return {router: path_ids[path_id] for router, path_id in state.items()}
+
+            for prefix in bm.prefix_list:
+                data = bm.log_data[prefix]
+                shard_data = shard.log_data[prefix]
+                # The last entry is the state at the end of the shard, which is 
+                # also the first entry of the next shard
+                nb_entries = len(shard_data['time'])
+                if shard_nb < len(shards)-1:
+                    nb_entries -= 1
+
+                if shard_nb > 0:
+                    diff = bm._state_diff(remap(shard.get_state(prefix, 0)), bm.monitors[prefix.lower()])
+                    if diff:
+                        print(f'Warning: {diff} routers changed state at shard '
+                              f'boundary {shard.starttime} for {prefix}')
+                        bm.boundary_diffs.append( (shard.starttime, prefix, diff) )
+
+                offset = len(data['time'])
+                for idx, state in shard_data['snapshot'].items():
+                    if idx < nb_entries:
+                        data['snapshot'][offset+idx] = remap(state)
+
+                for delta in shard_data['delta'][:nb_entries]:
+                    if delta is not None and delta[1] is not None:
+                        delta = (delta[0], path_ids[delta[1]])
+                    data['delta'].append(delta)
+
+                data['time'].extend(shard_data['time'][:nb_entries])
+                data['reachability'].extend(shard_data['reachability'][:nb_entries])
+                data['upstream'].extend(shard_data['upstream'][:nb_entries])
+
+                bm.monitors[prefix.lower()] = remap(shard.monitors[prefix.lower()])
+
+        bm.recount()
+        return bm
+
+    @staticmethod
+    def _state_diff(state1, state2):
+        """Number of routers with a different path in the two given states"""
+
+        return sum(1 for router in set(state1).union(state2) 
+                if state1.get(router) != state2.get(router))
+
+
+def rib_shards(starttime, endtime, hours=8):
+    """Split the given period of time into shards of the given number of hours.
+    Shards boundaries are aligned to RIB dump times (00:00, 08:00, or 16:00 UTC)
+    so that each shard can be bootstrapped with its own RIB."""
+
+    if hours % 8:
+        raise ValueError('Shards duration should be a multiple of 8 hours')
+
+    starttime = arrow.get(starttime)
+    endtime = arrow.get(endtime)
+
+    shards = []
+    shard_start = starttime
+    boundary = starttime.floor('day')
+    while shard_start < endtime:
+        while boundary <= shard_start:
+            boundary = boundary.shift(hours=hours)
+        shard_end = min(boundary, endtime)
+        shards.append( (shard_start, shard_end) )
+        shard_start = shard_end
+
+    return shards
+
+
+def save(bm, output, collector, format='columnar', append=False):
+    """Save BGPMonitor logs in the columnar format, with a checkpoint to 
+    resume monitoring later, or as a pickle file"""
+
+    if format == 'columnar':
+        bgpstore.export(bm, output, collector, append)
+        with open(os.path.join(output, CHECKPOINT_FNAME), 'wb') as fp:
+            pickle.dump(bm.checkpoint(), fp)
+    else:
+        output += '.pickle'
+        with open(output, 'wb') as fp:
+            pickle.dump(bm, fp)
+
+    return output
+
+
+def fetch_shard(collector, prefixes, starttime, endtime, my_asns, roa_timings=None,
+        end_date=None, path_hunting=0):
+    """Monitor prefixes for one shard of the measurement period. Returns the 
+    BGPMonitor and the processing time. If roa_timings are given, convergence 
+    delays are computed by the BGPMonitor's operator (end_date is the end of 
+    the whole measurement period). Path exploration episodes are also 
+    detected if path_hunting is given (see fetch_collector)."""
+
+    start = time.time()
+    bm = BGPMonitor(prefixes, starttime, endtime, my_asns)
+    # Results are kept in bm.operators and merged with other shards
+    run_operators(bm, lambda: bm.fetch_data(collector), roa_timings, path_hunting, end_date)
+
+    return bm, time.time()-start
+
+
+def run_operators(bm, run, roa_timings=None, path_hunting=0, endtime=None,
+        convergence_fname=None, hunting_fname=None, operators=[]):
+    """Register operators, read BGP data and write the operators results.
+
+    run: function reading BGP data with bm, called once operators are 
+    registered
+    roa_timings: CSV files of ROA actions, if given convergence delays are 
+    computed (see ConvergenceDelays)
+    path_hunting: if not 0, path exploration episodes ending after this number
+    of seconds without change are detected (see PathHunting)
+    endtime: end of the measurement period (see ConvergenceDelays)
+    convergence_fname/hunting_fname: CSV files where delays and episodes are
+    saved, if None results are only kept in bm.operators
+    operators: other operators registered first (e.g. ReachabilityEvents)
+    """
+
+    for operator in operators:
+        bm.add_operator(operator)
+
+    convergence = None
+    if roa_timings:
+        roa_timings = ROASchedule(roa_timings)
+        convergence = ConvergenceDelays(roa_timings, endtime)
+        bm.add_operator(convergence)
+
+    hunting = None
+    if path_hunting:
+        # Episodes are written as soon as they end
+        hunting = PathHunting(roa_timings, path_hunting, hunting_fname)
+        bm.add_operator(hunting)
+
+    run()
+
+    if convergence is not None and convergence_fname is not None:
+        convergence.to_csv(convergence_fname)
+    if hunting is not None:
+        hunting.finish(bm)
+
+
+def find_checkpoint(start_date, collector):
+    """Return the folder of the latest checkpointed results for the given 
+    collector and start date, None if there is none."""
+
+    folders = [ folder for folder in glob(f'bgpmonitor_{start_date}_*_{collector}')
+            if os.path.exists(os.path.join(folder, CHECKPOINT_FNAME)) ]
+
+    if not folders:
+        return None
+
+    # Folder names end with the date of the checkpoint
+    return sorted(folders)[-1]
+
+
+def fetch_collector(collector, prefixes, start_date, end_date, my_asns, 
+        format='columnar', resume=False, roa_timings=None, path_hunting=0):
+    """Monitor prefixes with data from one collector and save the results. 
+    Returns a summary of the processing.
+
+    resume: process only data after the latest checkpoint and append results
+    to the checkpointed logs (columnar format only).
+    roa_timings: CSV files of ROA actions, if given the convergence delays of 
+    each peer are saved in convergence_<start>_<end>_<collector>.csv (and their 
+    distributions in convergence_<start>_<end>_<collector>_sketches.json)
+    path_hunting: if not 0, path exploration episodes ending after this 
+    number of seconds without change are saved in 
+    pathhunting_<start>_<end>_<collector>.csv
+    """
+
+    start = time.time()
+    output = f'bgpmonitor_{start_date}_{end_date}_{collector}'
+
+    checkpoint_folder = find_checkpoint(start_date, collector) if resume else None
+    if checkpoint_folder is None:
+        bm = BGPMonitor(prefixes, start_date, end_date, my_asns)
+    else:
+        with open(os.path.join(checkpoint_folder, CHECKPOINT_FNAME), 'rb') as fp:
+            bm = BGPMonitor.resume(pickle.load(fp), end_date)
+        print(f'{collector}: resuming from {bm.starttime}')
+
+        if checkpoint_folder != output:
+            os.rename(checkpoint_folder, output)
+
+    if bm.starttime < bm.endtime:
+        suffix = f'{bm.starttime.format("YYYY-MM-DD")}_{end_date}_{collector}.csv'
+        run_operators(bm, lambda: bm.fetch_data(collector), roa_timings, path_hunting,
+                bm.endtime, 'convergence_'+suffix, 'pathhunting_'+suffix)
+        bm.operators = []
+
+        output = save(bm, output, collector, format, append=bm.resumed)
+
+    return {
+            'collector': collector,
+            'output': output,
+            'nb_updates': bm.nb_updates,
+            'nb_logs': sum(len(data['time']) for data in bm.log_data.values()),
+            'duration': time.time()-start,
+            }
+
+
+def print_event(event):
+    """Print monitoring events as JSON lines"""
+
+    print(ujson.dumps(event), flush=True)
+
+
+def monitor_live(prefixes, my_asns, collector, source='ris', replay_files=[], 
+        replay_rib=None, replay_speed=0, convergence_time=60, format='columnar',
+        roa_timings=None, path_hunting=0):
+    """Monitor prefixes in real time and print reachability and convergence 
+    events until interrupted (or the end of replayed files).
+
+    source: 'ris' for RIS Live or 'replay' for local MRT files
+    replay_files: MRT update files replayed with the 'replay' source
+    replay_rib: MRT RIB file used to bootstrap the 'replay' source
+    replay_speed: replay speed relative to real time, 0 for no delay
+    convergence_time: number of seconds without change before a prefix is 
+    considered converged
+    roa_timings: CSV files of ROA actions, if given the convergence delays of 
+    each peer are saved with the results
+    path_hunting: if not 0, path exploration episodes ending after this number
+    of seconds without change are saved with the results
+    """
+
+    if source == 'ris':
+        # Bootstrap with the last archived RIB and updates
+        starttime = rib_time(arrow.utcnow().shift(hours=-2))
+        bm = BGPMonitor(prefixes, starttime, arrow.utcnow(), my_asns)
+        bm.fetch_data(collector)
+        live_source = RISLiveSource(prefixes, collector)
+    else:
+        # Monitoring starts with the first replayed update
+        live_source = iter(MRTReplaySource(prefixes, replay_files, replay_speed))
+        first_update = next(live_source, None)
+        starttime = arrow.utcnow() if first_update is None else arrow.get(first_update.time)
+        live_source = itertools.chain([first_update] if first_update else [], live_source)
+
+        bm = BGPMonitor(prefixes, starttime, starttime, my_asns)
+        if replay_rib is not None:
+            bm.bootstrap( MRTReplaySource(prefixes, [replay_rib], record_type='ribs') )
+        for prefix in bm.prefix_list:
+            bm.log_state(prefix, bm.starttime)
+
+    def run():
+        try:
+            bm.run(live_source)
+        except KeyboardInterrupt:
+            pass
+
+    output = f'bgpmonitor_live_{bm.starttime.format("YYYY-MM-DDTHH:mm")}_{collector}'
+    run_operators(bm, run, roa_timings, path_hunting, None, output+'_convergence.csv',
+            output+'_pathhunting.csv', [ReachabilityEvents(print_event, convergence_time)])
+
+    # Log state at the end of the mesurement period
+    if source == 'ris':
+        bm.endtime = arrow.utcnow()
+    else:
+        bm.endtime = arrow.get(max(data['time'][-1] for data in bm.log_data.values()))
+    for prefix in bm.prefix_list:
+        bm.log_state(prefix, bm.endtime)
+
+    # operators are not saved
+    bm.operators = []
+    return save(bm, output, collector, format)
+
+
+def rib_period(collector):
+    """Return the number of hours between two RIB dumps of the given 
+    collector"""
+
+    if collector.startswith('route-views'):
+        return 2
+
+    return 8
+
+
+def rib_time(timestamp, hours=8):
+    """Return the time of the RIB dump preceding timestamp, RIBs are dumped 
+    every given number of hours starting at 00:00 UTC"""
+
+    timestamp = arrow.get(timestamp)
+    return timestamp.floor('hour').shift(hours=-(timestamp.hour % hours))
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Retrieve RIS/RV data for monitored prefixes')
-    parser.add_argument('--collector', default='rrc00',
-            help='Name of the BGP collector (default: rrc00)')
+    parser.add_argument('--collector', default=['rrc00'], nargs='+',
+            help='Name of the BGP collectors, or "all" for all RIS collectors (default: rrc00)')
+    parser.add_argument('--nb-proc', type=int, default=os.cpu_count(),
+            help='Number of collectors processed in parallel (default: number of CPUs)')
     parser.add_argument('--start-date', default='2021-10-07', 
             help='Starting date of the measurement (default: 2021-10-07).')
     parser.add_argument('--end-date', default = arrow.now().format('YYYY-MM-DD'),
             help="Ending date of the measurement (default is today's date)")
+    parser.add_argument('--shard-hours', type=int, default=0,
+            help='Split the measurement period into shards of this number of hours '
+            '(multiple of 8) processed in parallel, each one starting from its own RIB '
+            '(default: no sharding)')
+    parser.add_argument('--resume', action='store_true',
+            help='Process only data after the last checkpoint of each collector and '
+            'append it to the existing results (columnar format only)')
+    parser.add_argument('--live', choices=['ris', 'replay'],
+            help='Monitor prefixes in real time with RIS Live or by replaying local '
+            'MRT files, and print reachability/convergence events (first collector only)')
+    parser.add_argument('--replay-files', nargs='+', default=[],
+            help='MRT update files replayed with --live replay')
+    parser.add_argument('--replay-rib', 
+            help='MRT RIB file used to bootstrap monitors with --live replay')
+    parser.add_argument('--replay-speed', type=float, default=0,
+            help='Replay speed relative to real time (default: 0, no delay)')
+    parser.add_argument('--convergence-time', type=int, default=60,
+            help='Number of seconds without change before a prefix is considered '
+            'converged in live mode (default: 60)')
+    parser.add_argument('--roa-timings', nargs='+',
+            help='CSV files containing ROAs creation and deletion times. If given, '
+            'the delay between each ROA action and the first reaction of each peer '
+            'is computed while reading updates and saved in convergence_*.csv files, '
+            'along with quantile sketches of their distribution')
+    parser.add_argument('--path-hunting', type=int, default=0, metavar='SECONDS',
+            help='Detect path exploration episodes, an episode ends when a peer keeps '
+            'the same route for this number of seconds. Episodes are saved in '
+            'pathhunting_*.csv files, with --roa-timings only episodes following ROA '
+            'actions are kept (default: 0, disabled)')
+    parser.add_argument('--format', default='columnar', choices=['columnar', 'pickle'],
+            help='Output format (default: columnar)')
     parser.add_argument('--my-upstream', help='Upper AS in my control', nargs='+',
             default=['3130', '17660', '55722', '23676'])
     parser.add_argument('--prefixes', help='Prefixes to monitor', nargs='+',
@@ -176,12 +690,87 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    if args.resume and (args.format != 'columnar' or args.shard_hours):
+        parser.error('--resume works only with the columnar format and without sharding')
+
     print(f'starting date: {args.start_date}')
     print(f'ending date: {args.end_date}')
 
-    bm = BGPMonitor(args.prefixes, args.start_date, args.end_date, args.my_upstream)
-
-    bm.fetch_data(args.collector)
-    print('saving..')
-    with open(f'bgpmonitor_{args.start_date}_{args.end_date}_{args.collector}.pickle', 'wb') as fp:
-        pickle.dump(bm, fp)
+    collectors = args.collector
+    if 'all' in collectors:
+        collectors = RIS_COLLECTORS
+
+    if args.live:
+        output = monitor_live(args.prefixes, args.my_upstream, collectors[0], args.live,
+                args.replay_files, args.replay_rib, args.replay_speed, 
+                args.convergence_time, args.format, args.roa_timings, args.path_hunting)
+        print(f'saved to {output}')
+        sys.exit()
+
+    start = time.time()
+    nb_updates = 0
+    if args.shard_hours:
+        # One process per shard
+        shards = rib_shards(args.start_date, args.end_date, args.shard_hours)
+        collector_shards = defaultdict(list)
+        with ProcessPoolExecutor(max_workers=args.nb_proc) as executor:
+            futures = {
+                    executor.submit(fetch_shard, collector, args.prefixes,
+                        shard_start, shard_end, args.my_upstream, args.roa_timings,
+                        args.end_date, args.path_hunting): 
+                    (collector, shard_start)
+                    for collector in collectors for shard_start, shard_end in shards }
+
+            for nb_done, future in enumerate(as_completed(futures), 1):
+                collector, shard_start = futures[future]
+                bm, duration = future.result()
+                collector_shards[collector].append(bm)
+                print(f"[{nb_done}/{len(futures)}] {collector} {shard_start}: "
+                    f"{bm.nb_updates} updates in {duration:.0f}s "
+                    f"({bm.nb_updates/max(duration, 1):.0f} updates/s)")
+
+        for collector, shard_list in collector_shards.items():
+            operators = [ op for shard in shard_list for op in shard.operators ]
+            if args.roa_timings:
+                delays = merge_delays( op.delays for op in operators 
+                        if isinstance(op, ConvergenceDelays) )
+                fname = f'convergence_{args.start_date}_{args.end_date}_{collector}.csv'
+                write_delays(delays, fname)
+                sketch_delays(delays).save(sketches_fname(fname))
+            if args.path_hunting:
+                # Episodes overlapping shard boundaries are split
+                hunting = PathHunting(stable_time=args.path_hunting)
+                for op in operators:
+                    if isinstance(op, PathHunting):
+                        hunting.episodes.extend(op.episodes)
+                hunting.episodes.sort(key=lambda row: row[4])
+                hunting.to_csv(f'pathhunting_{args.start_date}_{args.end_date}_{collector}.csv')
+
+            bm = BGPMonitor.stitch(shard_list)
+            nb_updates += bm.nb_updates
+            output = save(bm, f'bgpmonitor_{args.start_date}_{args.end_date}_{collector}', 
+                    collector, args.format)
+            print(f'{collector}: {len(bm.boundary_diffs)} inconsistent shard boundaries, '
+                  f'saved to {output}')
+
+    else:
+        # One process per collector
+        with ProcessPoolExecutor(max_workers=min(args.nb_proc, len(collectors))) as executor:
+            futures = [
+                    executor.submit(fetch_collector, collector, args.prefixes,
+                        args.start_date, args.end_date, args.my_upstream, args.format,
+                        args.resume, args.roa_timings, args.path_hunting)
+                    for collector in collectors ]
+
+            for nb_done, future in enumerate(as_completed(futures), 1):
+                summary = future.result()
+                nb_updates += summary['nb_updates']
+                print(f"[{nb_done}/{len(collectors)}] {summary['collector']}: "
+                    f"{summary['nb_updates']} updates ({summary['nb_logs']} logged) "
+                    f"in {summary['duration']:.0f}s "
+                    f"({summary['nb_updates']/max(summary['duration'], 1):.0f} updates/s), "
+                    f"saved to {summary['output']}")
+
+    duration = time.time()-start
+    print(f'Done: {len(collectors)} collectors, {nb_updates} updates in {duration:.0f}s '
+          f'({nb_updates/max(duration, 1):.0f} updates/s)')
@@ -4,15 +4,19 @@ import arrow
 import datetime
 import numpy as np
 from collections import Counter, defaultdict
-from matplotlib import pylab as plt
 import os
-import pickle
 import ujson
-from bgpmonitor import BGPMonitor
+from bgpstore import BGPStore
+from delays import cache_key, cached_delays, extract_delays, iter_rows
+from render import (DISTRIBUTION_FORMATS, FORMATS, STACK_FORMATS, TIMELINE_FORMATS,
+        TIMELINE_RESOLUTION, Renderer, downsample, ecdf_figure, stack_figure, 
+        timeline_figure)
+from roaschedule import ROASchedule, to_datetime
+from sketch import QuantileSketch, SketchTable
 
 asn_file = open('rrc00_asns.txt', 'w')
 
-MY_ASNS = ['3130', '3970', '17660', '55722', '23676']
+MY_ASNS = [3130, 3970, 17660, 55722, 23676]
 MIN_NB_PEERS = 5
 MAX_DELAY_HOURS = 24 # ROA wiggling should be less than 24h
 
@@ -75,95 +79,207 @@ PREFIX_PROP_FIX = {
         }
 
 
-def ecdf(a, ax=None, add_zero=True, **kwargs):
-    """Plot the Empirical Cumulative Density Function.
-    
-    parameters:
-        a: The data of interest. Should be a list or a 1D numpy array.
-        ax: The axes of the figure.
-        add_zero: Set to True to connect the graph to y=0
-        **kwargs: Any other option to pass to pylab.plot.
-        
-    Returns a dictionary providing the CDF value for each point on the x axis.
+def asn_breakdown(bm, prefix, epochs, props=None):
+    """Count how many times prominent ASNs appear in the AS paths of the given
+    prefix. Counts are updated with each logged path change, only changes 
+    are kept so the result should be drawn as steps (step='post').
+
+    Prominent ASNs are not in MY_ASNS and appear in more than MIN_NB_PEERS
+    paths at some point in time.
+
+    epochs: time of each log entry (see get_epochs)
+    props: PREFIX_PROP of the prefix, entries outside its startdate and enddate
+    are ignored
+
+    Returns the times, one array of counts per ASN and the list of ASNs.
     """
-    sorted=np.sort( a )
-    yvals=np.arange(len(sorted)+1)/float(len(sorted))
-    if add_zero:
-        starti = 0
-        sorted = np.append( sorted[0], sorted )
-    else:
-        starti=1
-    if ax is None:
-        plt.plot( sorted, yvals[starti:], **kwargs )
-    else:
-        ax.plot( sorted, yvals[starti:], **kwargs )
 
-    return {k:v for k,v in zip(sorted, yvals)}
+    data = bm.log_data[prefix]
+    nb_entries = len(data['time'])
+    if not nb_entries:
+        return np.array([], dtype=np.int64), np.zeros((0, 0), dtype=np.int64), []
+
+    # ASN counts of each path, with prepended ASNs counted every time
+    path_asns = {}
+    def get_asns(path_id):
+        asns = path_asns.get(path_id)
+        if asns is None:
+            asns = Counter(bm.paths[path_id].tolist())
+            path_asns[path_id] = asns
+        return asns
+
+    counts = Counter()
+    # ASN -> log indices and values of its count when it changed
+    changes = defaultdict(lambda: ([], []))
+    max_counts = Counter()
+
+    def set_count(idx, asn, value):
+        indices, values = changes[asn]
+        if indices and indices[-1] == idx:
+            values[-1] = value
+        else:
+            indices.append(idx)
+            values.append(value)
+        if value > max_counts[asn]:
+            max_counts[asn] = value
+
+    def reset(idx, state):
+        previous = set(counts)
+        counts.clear()
+        for path_id in state.values():
+            counts.update(get_asns(path_id))
+        for asn in previous.union(counts):
+            set_count(idx, asn, counts.get(asn, 0))
+
+    state = bm.get_state(prefix, 0)
+    reset(0, state)
+    for idx in range(1, nb_entries):
+        if idx in data['snapshot']:
+            state = dict(data['snapshot'][idx])
+            reset(idx, state)
+            continue
+
+        delta = data['delta'][idx]
+        if delta is None:
+            continue
+
+        router, path_id = delta
+        old_path_id = state.get(router)
+        if old_path_id == path_id:
+            continue
+        bm._apply_delta(state, delta)
+
+        diff = Counter()
+        if old_path_id is not None:
+            diff.subtract(get_asns(old_path_id))
+        if path_id is not None:
+            diff.update(get_asns(path_id))
+        for asn, increment in diff.items():
+            if increment:
+                counts[asn] += increment
+                set_count(idx, asn, counts[asn])
+
+    asns = [ asn for asn, max_count in max_counts.items()
+            if asn not in MY_ASNS and max_count > MIN_NB_PEERS ]
+
+    # Window of log entries to plot, epochs are sorted
+    first, last = 0, nb_entries
+    if props is not None:
+        first = np.searchsorted(epochs, props['startdate'].timestamp(), 'left')
+        last = np.searchsorted(epochs, props['enddate'].timestamp(), 'right')
+    if first >= last:
+        return epochs[:0], np.zeros((len(asns), 0), dtype=np.int64), asns
+
+    # Counts are needed only where one of the ASNs changed, plus the first
+    # and last entries of the window
+    points = [ np.array(changes[asn][0], dtype=np.int64) for asn in asns ]
+    points = np.unique(np.concatenate(points+[[first, last-1]]).astype(np.int64))
+    points = points[(points >= first) & (points < last)]
+
+    y = np.zeros((len(asns), len(points)), dtype=np.int64)
+    for asn_idx, asn in enumerate(asns):
+        indices, values = changes[asn]
+        # counts are 0 before the first change
+        values = np.concatenate([[0], values])
+        y[asn_idx] = values[np.searchsorted(indices, points, 'right')]
+    x = epochs[points]
+
+    # Keep only entries where the breakdown changes, and the last one
+    changed = np.ones(len(x), dtype=bool)
+    changed[1:] = (y[:, 1:] != y[:, :-1]).any(axis=0)
+    changed[-1] = True
+    x, y = x[changed], y[:, changed]
+
+    return x, y, asns
 
 
 class BGPPlot():
-    def __init__(self, bgpmonitors, roa_timings):
+    def __init__(self, bgpmonitors, roa_timings, delays=None, renderer=None, 
+            delay_sketches=None):
+        """bgpmonitors: dictionary of BGPMonitor (or BGPStore) per collector
+        roa_timings: CSV files containing ROAs creation and deletion times
+        delays: table of delays previously computed by get_delays(), the
+        bgpmonitors are not needed for delay distributions if it is given
+        renderer: Renderer used to draw figures (default: figures are drawn 
+        one by one in the current process)
+        delay_sketches: SketchTable of delays per (action, peer, prefix) saved
+        while monitoring (see convergence.ConvergenceDelays), if given delay
+        distributions are plotted from it and delays are not needed
+        """
         
         self.bgpmonitors = bgpmonitors
         self.roa_timings = roa_timings
+        self.roa_schedule = ROASchedule(roa_timings)
+        self.delays = delays
+        self.delay_sketches = delay_sketches
+        self.renderer = Renderer() if renderer is None else renderer
+        # Distribution of delays per (action, peer|'all', prefix)
+        self.sketches = SketchTable()
         self.peer_counts = defaultdict(lambda: defaultdict(int) )
         self.log_updates = defaultdict(list)
         self.log_updates_counts = defaultdict(Counter)
         self.log_long_updates = []
         self.log_long_updates_counts = defaultdict(Counter)
 
-    def plot_timeline(self, upstream=False, all_asn=False):
-        """Plot reachability and AS path breakdown as a function of time."""
+    def plot_timeline(self, upstream=False, all_asn=False, 
+            resolution=TIMELINE_RESOLUTION, zoom=None):
+        """Plot reachability and AS path breakdown as a function of time.
+
+        resolution: number of pixel columns, series are downsampled to keep
+        only the first, last, min and max values of each column
+        zoom: if given, also plot the reachability zoomed on each ROA action,
+        from zoom seconds before the action to zoom seconds after
+        """
 
         for collector, bm in self.bgpmonitors.items():
 
             for prefix, data in bm.log_data.items():
                 print('plotting data for '+prefix)
-                # Plot prefix reachability
-                plt.figure(figsize=(20,4))
-                plt.title('Reachability of '+prefix)
-                plt.ylabel('# RIS Peers')
-                plt.grid(visible=True, alpha=0.2)
-                plt.xticks(rotation=45)
-                if data['reachability']:
-                    plt.ylim( [0, max(data['reachability'])+1])
-                
+                epochs = bm.get_epochs(prefix)
+
                 # Find index of start_date
                 start_idx = min(i for i, ts in enumerate(data['time']) if not prefix in PREFIX_PROP 
                         or ts > PREFIX_PROP[prefix]['startdate']
                         or ts < PREFIX_PROP[prefix]['enddate']
                         )
 
-                plt.step(data['time'][start_idx:], data['reachability'][start_idx:], where='post')
-
                 # Add ROA creation/deletion timings
-                for roa_log in self.roa_timings:
-                    with open(roa_log, 'r') as log:
-                        for line in log:
-                            time, action, roa_prefix, asn, _ = line.split(',')
-
-                            if prefix != roa_prefix:
-                                continue
-
-                            time = arrow.get(time)
-
-                            if time > bm.starttime and time < bm.endtime and ( 
-                                    not prefix in PREFIX_PROP 
-                                    or time > PREFIX_PROP[prefix]['startdate']
-                                    or time < PREFIX_PROP[prefix]['enddate']
-                                    ):
-                                plt.annotate(action, xy=(time.datetime, 0), xytext=(0, 75),
-                                    textcoords="offset points", 
-                                    ha='center', va='top',
-                                    arrowprops={'arrowstyle':'->'}, 
-                                # rotation=60, 
-                                    fontsize=8
-                                    )
-
-                plt.tight_layout()
-                plt.savefig(f'fig/{prefix.replace("/","_")}_{collector}.png')
-                plt.close()
+                annotations = []
+                times, actions = self.roa_schedule.get_actions(prefix, bm.starttime, bm.endtime)
+                for time, action in zip(times, actions.tolist()):
+                    time = to_datetime(time)
+
+                    if ( not prefix in PREFIX_PROP 
+                            or time > PREFIX_PROP[prefix]['startdate']
+                            or time < PREFIX_PROP[prefix]['enddate']
+                            ):
+                        annotations.append( (time.timestamp(), action) )
+
+                # Plot prefix reachability
+                x = epochs[start_idx:]
+                y = np.array(data['reachability'][start_idx:])
+                sampled_x, sampled_y = downsample(x, y, resolution)
+                self.renderer.submit(timeline_figure, f'fig/{prefix.replace("/","_")}_{collector}',
+                        TIMELINE_FORMATS, title='Reachability of '+prefix, 
+                        x=sampled_x, y=sampled_y, annotations=annotations)
+
+                # Zoom on each ROA action
+                if zoom is not None:
+                    for timestamp, action in annotations:
+                        # Start with the value at the beginning of the window
+                        first = max(np.searchsorted(x, timestamp-zoom, 'right')-1, 0)
+                        last = np.searchsorted(x, timestamp+zoom, 'right')
+                        if first >= last:
+                            continue
 
+                        zoom_x, zoom_y = downsample(
+                                np.maximum(x[first:last], timestamp-zoom), y[first:last], resolution)
+                        self.renderer.submit(timeline_figure, 
+                                f'fig/{prefix.replace("/","_")}_{collector}_zoom_{int(timestamp)}',
+                                TIMELINE_FORMATS, title=f'Reachability of {prefix} ({action})', 
+                                x=zoom_x, y=zoom_y, 
+                                annotations=[ annotation for annotation in annotations 
+                                    if abs(annotation[0]-timestamp) <= zoom ])
 
                 # Plot upstream breakdown
                 if upstream:
@@ -171,10 +287,11 @@ class BGPPlot():
                     upstreams = set()
                     for datapoint in data['upstream']:
                         upstreams.update( datapoint.keys() )
+                    upstreams = list(upstreams)
 
                     # Sample data for all upstream
-                    x = []
-                    y = [[] for _ in upstreams]
+                    selected = []
+                    y = []
                     for time_idx, datapoint in enumerate(data['upstream']):
 
                         if prefix in PREFIX_PROP and(
@@ -183,250 +300,119 @@ class BGPPlot():
                                 ):
                             continue
 
-                        ## x-axis
-                        x.append(data['time'][time_idx])
-                        # Make nice flat steps
-                        if time_idx+1 < len(data['time']):
-                            x.append(data['time'][time_idx+1])
-
-                        ## y-axis
-                        for up_idx, upstream in enumerate(upstreams):
-                            y[up_idx].append(datapoint.get(upstream, 0))
-                            # Make nice flat steps
-                            if time_idx+1 < len(data['time']):
-                                y[up_idx].append(datapoint.get(upstream, 0))
-
-                    if len(x) > 3:
-                        plt.figure(figsize=(8,3))
-                        plt.title('Upstream of '+prefix)
-                        plt.ylabel('# RIS Peers')
-                        plt.grid(visible=True, alpha=0.2)
-                        plt.xticks(rotation=45)
-                        plt.stackplot(x, y, labels=upstreams)
-                        plt.legend()
-                        plt.tight_layout()
-                        plt.savefig(f'fig/{prefix.replace("/","_")}_upstreams_{collector}.png')
-                        plt.savefig(f'fig/{prefix.replace("/","_")}_upstreams_{collector}.pdf')
-                        plt.close()
+                        selected.append(time_idx)
+                        y.append([datapoint.get(upstream, 0) for upstream in upstreams])
+
+                    if len(selected) > 1:
+                        x, y = downsample(epochs[selected], np.array(y).T, resolution)
+                        self.renderer.submit(stack_figure, 
+                                f'fig/{prefix.replace("/","_")}_upstreams_{collector}',
+                                STACK_FORMATS, title='Upstream of '+prefix, ylabel='# RIS Peers',
+                                x=x, y=y, labels=upstreams, step='post')
 
                 # Plot all AS breakdown
                 if all_asn:
-                    ## Find all prominent asns
-                    asns = set()
-                    for datapoint in data['aspath']:
-                        nb_peers = Counter()
-                        for aspath in datapoint:
-                            nb_peers.update(aspath)
-                            
-                        for asn, count in nb_peers.items():
-                            if asn not in MY_ASNS and count > MIN_NB_PEERS:
-                                asns.add( asn )
-
-                    # Sample data for all as on the path
-                    x = []
-                    y = [[] for _ in asns]
-                    for time_idx, datapoint in enumerate(data['aspath']):
+                    x, y, asns = asn_breakdown(bm, prefix, epochs, PREFIX_PROP.get(prefix))
+                    x, y = downsample(x, y, resolution)
 
-                        if prefix in PREFIX_PROP and(
-                                data['time'][time_idx] < PREFIX_PROP[prefix]['startdate']
-                                or data['time'][time_idx] > PREFIX_PROP[prefix]['enddate']
-                                ):
-                            continue
+                    if len(x) > 1 and len(y) > 2:
+                        self.renderer.submit(stack_figure, 
+                                f'fig/{prefix.replace("/","_")}_aspath_{collector}',
+                                STACK_FORMATS, title='ASNs in path to '+prefix, ylabel='# AS Paths',
+                                x=x, y=y, labels=asns, step='post')
 
-                        ## x-axis
-                        x.append(data['time'][time_idx])
-                        # Make nice flat steps
-                        if time_idx+1 < len(data['time']):
-                            x.append(data['time'][time_idx+1])
-
-                        ## y-axis
-                        ### Count how many time ASNs appear in AS paths
-                        nb_peers = Counter()
-                        for aspath in datapoint:
-                            nb_peers.update(aspath)
-                            
-                        ## Store as a step graph
-                        for asn_idx, asn in enumerate(asns):
-                            y[asn_idx].append(nb_peers.get(asn, 0))
-                            # Make nice flat steps
-                            if time_idx+1 < len(data['time']):
-                                y[asn_idx].append(nb_peers.get(asn, 0))
-
-                    if len(x) > 3 and len(y) > 2:
-                        plt.figure(figsize=(8,3))
-                        plt.title('ASNs in path to '+prefix)
-                        plt.ylabel('# AS Paths')
-                        plt.grid(visible=True, alpha=0.2)
-                        plt.xticks(rotation=45)
-                        plt.stackplot(x, y, labels=asns)
-                        plt.legend()
-                        plt.tight_layout()
-                        plt.savefig(f'fig/{prefix.replace("/","_")}_aspath_{collector}.png')
-                        plt.savefig(f'fig/{prefix.replace("/","_")}_aspath_{collector}.pdf')
-                        plt.close()
-
-
-
-    def plot_delay_dist(self):
-        """Plot distibution of the different timings found in logs"""
-        
-        
-        # all_delays[create/delete][peer|'all'][prefix]= [...]
-        all_delays = {
-                'create': defaultdict(lambda: defaultdict(list)),
-                'delete': defaultdict(lambda: defaultdict(list))
-        }
+        self.renderer.wait()
 
-        for roa_log in self.roa_timings:
-
-            # Retrieve the start/end timings for each ROA create and delete
-            # binned_log[prefix][create][ [start, end], [start,end], ...]
-            binned_log = defaultdict(lambda: {
-                'create': [[]],
-                'delete': [[]]
-                })
-            inverse_action = {'create': 'delete', 'delete': 'create'}
-
-            with open(roa_log, 'r') as log:
-                for line in log:
-                    time_str, action, prefix, asn, _ = line.split(',')
-                    timestamp = arrow.get(time_str, tzinfo='UTC')
-                    prefix = prefix.lower()
-
-                    binned_log[prefix][action].append([timestamp])
-                    binned_log[prefix][inverse_action[action]][-1].append(timestamp)
-
-            # timings[create|delete][prefix][peer] = [...]
-            timings = {
-                'create': defaultdict(lambda: defaultdict(list)),
-                'delete': defaultdict(lambda: defaultdict(list))
-                    } 
-
-            for prefix, action_log in binned_log.items():
-                for action, log in action_log.items():
-                    for bin in log:
-                        if len(bin) !=  2:
-                            print('error ', action, bin)
-                            continue
 
-                        bin_start, bin_end = bin
+    def get_delays(self):
+        """Return the table of delays between ROA actions and BGP updates (see
+        delays.extract_delays), computed only once."""
 
-                        # Check ARIN results after 5am
-                        # if bin_start.hour < 5:
-                            # continue
+        if self.delays is None:
+            periods = { prefix: (props['startdate'], props['enddate']) 
+                    for prefix, props in PREFIX_PROP.items() }
+            self.delays = extract_delays(self.bgpmonitors, self.roa_schedule, periods)
 
-                        if prefix in PREFIX_PROP and (
-                                bin_start < PREFIX_PROP[prefix]['startdate']
-                                or bin_end > PREFIX_PROP[prefix]['enddate']
-                                ):
-                            continue
+        return self.delays
+
+    def plot_delay_dist(self, summary_stats=None):
+        """Plot distibution of the different timings found in logs, or of
+        the delays summarized in self.delay_sketches. Saved sketches are
+        plotted as is (delays are not filtered with PREFIX_PROP and
+        MAX_DELAY_HOURS) and update logs are not available in that case.
+
+        summary_stats: JSON file where median delays are saved (default: not 
+        saved)
+        """
+        
+        
+        # all_delays[create/delete][peer|'all'][prefix]= QuantileSketch
+        all_delays = {
+                'create': defaultdict(lambda: defaultdict(QuantileSketch)),
+                'delete': defaultdict(lambda: defaultdict(QuantileSketch))
+        }
 
-                        #print(action, bin_start, bin_end)
-                        #if( bin_end - bin_start > datetime.timedelta(hours=MAX_DELAY_HOURS) ):
-                        #    print(f'WARNING: Ignoring {action} starting on {bin_start} and ending on {bin_end}')
-                        #    continue
-
-                        for bm in self.bgpmonitors.values():
-                            if( prefix not in bm.log_data
-                                    or bin_end < bm.log_data[prefix]['time'][0]
-                                    or bin_end > bm.log_data[prefix]['time'][-1]):
-                                continue
-
-                            start_idx = next(x for x, val in enumerate(bm.log_data[prefix]['time'])
-                                                if val > bin_start)
-                            end_idx = next(x for x, val in enumerate(bm.log_data[prefix]['time'])
-                                                if val > bin_end)
-
-                            bgp = {
-                                'time': bm.log_data[prefix]['time'][start_idx-1:end_idx],
-                                'aspath': bm.log_data[prefix]['aspath'][start_idx-1:end_idx],
-                                }
-
-                            peers_state = dict()
-                            prev_peers = None
-                            for bgp_time, aspaths in zip(bgp['time'], bgp['aspath']):
-                                if prev_peers is None:
-                                    prev_peers = set([path[0] for path in aspaths])
-                                    continue
-
-                                peers = set([path[0] for path in aspaths])
-                                diff = prev_peers.symmetric_difference(peers) 
-
-                                for updated_peer in diff:
-                                    # ignore flapping
-                                    if (
-                                        (action == 'create' and updated_peer in prev_peers and updated_peer not in peers)
-                                        or 
-                                        (action == 'delete' and updated_peer not in prev_peers and updated_peer in peers)
-                                        ):
-                                        continue
-
-                                    if updated_peer not in peers_state:
-                                        delay = bgp_time - bin_start
-                                        peers_state[updated_peer] = delay
-                                        delay_min = delay.total_seconds()/60
-                                        # we don't want to interfer with next day
-                                        # measurement
-                                        if delay_min < MAX_DELAY_HOURS*60/2:
-                                            timings[action][prefix][updated_peer].append(delay_min)
-                                            self.peer_counts[updated_peer][action+'_ok'] += 1
-                                            updated_peer_path = [path for path in aspaths if path[0] == updated_peer]
-
-                                            self.log_updates[updated_peer].append(
-                                                ( 
-                                                    action,
-                                                    updated_peer,
-                                                    prefix,
-                                                    bin_start,
-                                                    bgp_time,
-                                                    delay_min,
-                                                    updated_peer_path
-                                                ) 
-                                            )
-                                            self.log_updates_counts[action+'_peer'].update([updated_peer])
-
-                                            # log worst cases
-                                            if ( delay_min > 100 
-                                                and prefix in PREFIX_PROP
-                                                and not PREFIX_PROP[prefix]['label'][:4] in ['ARIN', 'LACN']):
-
-                                                self.log_long_updates.append(
-                                                    ( 
-                                                        action,
-                                                        updated_peer,
-                                                        prefix,
-                                                        bin_start,
-                                                        bgp_time,
-                                                        delay_min,
-                                                        updated_peer_path
-                                                    ) 
-                                                )
-                                                self.log_long_updates_counts[action+'_peer'].update([updated_peer])
-
-                                        else:
-                                            self.peer_counts[updated_peer][action+'_missed'] += 1
-
-                                        if( delay_min > 100 and action == 'create' 
-                                                and prefix in PREFIX_PROP
-                                                and not PREFIX_PROP[prefix]['label'][:4] in ['ARIN', 'LACN']):
-                                            print(updated_peer, PREFIX_PROP[prefix]['label'], delay_min, bin_start, bgp_time)
-
-
-                                prev_peers = peers
-
-
-            for action, prefix_data in timings.items():
-                for prefix, peer_data in prefix_data.items():
-                    #print(action, prefix)
-                    for peer, data in peer_data.items():
-                        all_delays[action][peer][prefix].extend(data)
-                        all_delays[action]['all'][prefix].extend(data)
+        rows = []
+        if self.delay_sketches is not None:
+            # Distributions of all peers are rebuilt if they are not saved
+            has_all = any( peer == 'all' for (_, peer, _), _ in self.delay_sketches.items() )
+            for (action, peer, prefix), sketch in self.delay_sketches.items():
+                if action not in all_delays:
+                    continue
+                all_delays[action][peer][prefix].merge(sketch)
+                if not has_all:
+                    all_delays[action]['all'][prefix].merge(sketch)
+        else:
+            rows = iter_rows(self.get_delays())
+
+        for row in rows:
+            action, prefix, updated_peer, collector, bin_start, bgp_time, delay_min, path = row
+            bin_start = arrow.get(bin_start)
+            bgp_time = datetime.datetime.fromtimestamp(bgp_time, datetime.timezone.utc)
+
+            if( delay_min > 100 and action == 'create' 
+                    and prefix in PREFIX_PROP
+                    and not PREFIX_PROP[prefix]['label'][:4] in ['ARIN', 'LACN']):
+                print(updated_peer, PREFIX_PROP[prefix]['label'], delay_min, bin_start, bgp_time)
+
+            # we don't want to interfer with next day measurement
+            if delay_min >= MAX_DELAY_HOURS*60/2:
+                self.peer_counts[updated_peer][action+'_missed'] += 1
+                continue
+
+            all_delays[action][updated_peer][prefix].add(delay_min)
+            all_delays[action]['all'][prefix].add(delay_min)
+            self.peer_counts[updated_peer][action+'_ok'] += 1
+
+            updated_peer_path = [[int(asn) for asn in aspath.split(' ')] for aspath in path.split('|') if aspath]
+            update = ( 
+                    action,
+                    updated_peer,
+                    prefix,
+                    bin_start,
+                    bgp_time,
+                    delay_min,
+                    updated_peer_path
+                    ) 
+
+            self.log_updates[updated_peer].append(update)
+            self.log_updates_counts[action+'_peer'].update([updated_peer])
+
+            # log worst cases
+            if ( delay_min > 100 
+                and prefix in PREFIX_PROP
+                and not PREFIX_PROP[prefix]['label'][:4] in ['ARIN', 'LACN']):
+
+                self.log_long_updates.append(update)
+                self.log_long_updates_counts[action+'_peer'].update([updated_peer])
 
 
         # Plot all distributions
         os.makedirs('fig/distributions/', exist_ok=True)
 
-        stats = ujson.load(open('../summary_stats.json'))
+        stats = {'create': {}, 'delete': {}}
+        if summary_stats is not None:
+            stats = ujson.load(open(summary_stats))
 
         for action, peer_data in all_delays.items():
             for peer, prefix_data in peer_data.items():
@@ -434,10 +420,10 @@ class BGPPlot():
                 if action == 'create':
                     asn_file.write(f"{peer}\n")
 
-                plt.figure()
-
+                series = []
                 max_value = 0
-                for prefix, data in prefix_data.items():
+                for prefix, sketch in prefix_data.items():
+                    self.sketches[(action, peer, prefix)] = sketch
 
                     if prefix.lower() in PREFIX_PROP:
                         props = PREFIX_PROP[prefix.lower()]
@@ -447,15 +433,15 @@ class BGPPlot():
                     if peer == 'all':
                         if props['label'] not in stats[action]:
                             stats[action][props['label']] = {}
-                        stats[action][props['label']]['BGP'] = np.median(data)
-                        print(f'{action} median for {props["label"]}: {np.median(data):.0f}')
+                        stats[action][props['label']]['BGP'] = sketch.median()
+                        print(f'{action} median for {props["label"]}: {sketch.median():.0f}')
                     else:
                         with open(f'fig/distributions/AS{peer}_median.txt', 'a') as fp:
-                            fp.write(f'{action} {props["label"]} median = {np.median(data):.0f}\n')
+                            fp.write(f'{action} {props["label"]} median = {sketch.median():.0f}\n')
 
-                    ecdf(data, label=props['label'], color=props['color'], 
-                            linestyle=props['linestyle'])
-                    max_value = np.max([max_value, np.max(data)])
+                    series.append( (sketch.ecdf_points(), {'label': props['label'], 
+                        'color': props['color'], 'linestyle': props['linestyle']}) )
+                    max_value = max(max_value, sketch.max)
 
                 peer_label = 'AS'+peer
                 if peer == 'all':
@@ -467,34 +453,23 @@ class BGPPlot():
                 elif action == 'delete':
                     action_label = 'User query to BGP withdraw delay'
 
-                plt.grid(visible=True, which='major', alpha=0.35)
-                plt.grid(visible=True, which='minor', linestyle='--', alpha=0.25)
-                plt.title(f'{action_label} - {peer_label}')
-                plt.xlabel('Delay (minutes)')
-                plt.ylabel('CDF')
-                plt.legend()
+                log_fname = None
                 if max_value > 200:
-                    plt.xscale('log')
-                    plt.xlim([1, 800])
-                    plt.savefig(f'fig/distributions/{action}_{peer}_log.pdf')
-                    pickle.dump(plt.gcf(), open(f'fig/distributions/{action}_{peer}_log.pickle', 'wb')) 
-
-                plt.xscale('linear')
-                plt.xlim([0, 60])
-                plt.savefig(f'fig/distributions/{action}_{peer}.pdf')
-                pickle.dump(plt.gcf(), open(f'fig/distributions/{action}_{peer}.pickle', 'wb')) 
+                    log_fname = f'fig/distributions/{action}_{peer}_log'
 
-                plt.close()
+                self.renderer.submit(ecdf_figure, f'fig/distributions/{action}_{peer}', 
+                        DISTRIBUTION_FORMATS, title=f'{action_label} - {peer_label}', 
+                        series=series, log_fname=log_fname)
                 
-        ujson.dump(stats, open('../summary_stats.json', 'w'))
+        if summary_stats is not None:
+            ujson.dump(stats, open(summary_stats, 'w'))
                                     
 
         ## Plot Tier1 together
         peer_color = []
         for action, peer_data in all_delays.items():
 
-            plt.figure()
-
+            series = []
             for peer, prefix_data in peer_data.items():
 
                 # tier1 clique: 174 209 286 701 1239 1299 2828 2914 3257 3320 3356 3491 5511 6453 6461 6762 6830 7018 12956
@@ -511,36 +486,31 @@ class BGPPlot():
                     asn_file.write(f"{peer}\n")
 
 
-                peer_data = []
-                for prefix, data in prefix_data.items():
+                peer_data = QuantileSketch()
+                for prefix, sketch in prefix_data.items():
 
                     if prefix.lower() in PREFIX_PROP:
                         props = PREFIX_PROP[prefix.lower()]
                     else:
                         continue
 
-                    peer_data.extend(data)
+                    peer_data.merge(sketch)
 
-                if peer_data:
-                    ecdf(peer_data, label=f'AS{peer}', color=f'C{peer_color.index(peer)}')
+                if peer_data.count:
+                    series.append( (peer_data.ecdf_points(), 
+                        {'label': f'AS{peer}', 'color': f'C{peer_color.index(peer)}'}) )
 
-                    action_label = ''
-                    if action == 'create':
-                        action_label = 'User query to BGP update delay - Tier1'
-                    elif action == 'delete':
-                        action_label = 'User query to BGP withdraw delay - Tier1'
+            if series:
+                action_label = ''
+                if action == 'create':
+                    action_label = 'User query to BGP update delay - Tier1'
+                elif action == 'delete':
+                    action_label = 'User query to BGP withdraw delay - Tier1'
 
-                    plt.grid(visible=True, which='major', alpha=0.35)
-                    plt.grid(visible=True, which='minor', linestyle='--', alpha=0.25)
-                    plt.title( action_label )
-                    plt.xlabel('Delay (minutes)')
-                    plt.ylabel('CDF')
-                    plt.legend()
-                    plt.xlim([0, 60])
-                    plt.savefig(f'fig/distributions/{action}_tier1.pdf')
-                    pickle.dump(plt.gcf(), open(f'fig/distributions/{action}_tier1.pickle', 'wb')) 
+                self.renderer.submit(ecdf_figure, f'fig/distributions/{action}_tier1', 
+                        DISTRIBUTION_FORMATS, title=action_label, series=series)
 
-            plt.close()
+        self.renderer.wait()
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -551,24 +521,75 @@ if __name__ == '__main__':
             default=['../apnic/roa_timings.csv','../ripe/roa_timings.csv',
         '../afrinic/roa_timings.csv', '../arin/roa_timings.csv', 
         '../lacnic/roa_timings.csv'])
-    parser.add_argument('bgp_timings', nargs='+',
-            help='Pickle files containing BGP timings for monitored prefixes.')
+    parser.add_argument('--prefixes', nargs='+',
+            help='Load only these prefixes (columnar format only, default: all)')
+    parser.add_argument('--summary-stats',
+            help='JSON file where median delays are saved (e.g. ../summary_stats.json, '
+            'default: not saved)')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS,
+            help='Formats of all figures, "pickle" saves matplotlib figures (default: '
+            'png for timelines, png and pdf for breakdowns, pdf for distributions)')
+    parser.add_argument('--nb-proc', type=int, default=os.cpu_count(),
+            help='Number of processes rendering figures (default: number of CPUs)')
+    parser.add_argument('--recompute', action='store_true',
+            help='Ignore cached delays and compute them again')
+    parser.add_argument('--sketches', nargs='+',
+            help='Delay sketches saved while monitoring (e.g. convergence_*_sketches.json '
+            'files of bgpmonitor.py --roa-timings). If given, distributions are plotted '
+            'from them without BGP timings')
+    parser.add_argument('bgp_timings', nargs='*',
+            help='Pickle files or columnar folders containing BGP timings for monitored prefixes.')
 
     args = parser.parse_args()
+    if not args.bgp_timings and not args.sketches:
+        parser.error('BGP timings or --sketches are required')
+
+    def load_bgpmonitors():
+        # Loading pickle files or columnar folders
+        bgpmonitors = {}
+        for bm_fname in args.bgp_timings:
+            if os.path.isdir(bm_fname):
+                bm = BGPStore(bm_fname, args.prefixes)
+                bgpmonitors[bm.collector] = bm
+                continue
+
+            with open(bm_fname, 'rb') as fp:
+                collector = bm_fname.rpartition('_')[2].partition('.')[0]
+                bgpmonitors[collector] = pickle.load(fp)
+
+        return bgpmonitors
+
+    # Delays are cached, BGP data is loaded only if they have to be computed
+    periods = { prefix: [str(props['startdate']), str(props['enddate'])]
+            for prefix, props in PREFIX_PROP.items() }
+    key = cache_key(args.bgp_timings+args.roa_timings, args.prefixes, periods)
+
+    def compute_delays():
+        print('computing delays..')
+        return BGPPlot( load_bgpmonitors(), args.roa_timings ).get_delays()
+
+    delays = None
+    delay_sketches = None
+    if args.sketches:
+        # Sketches of several collectors or periods are merged
+        delay_sketches = SketchTable()
+        for fname in args.sketches:
+            delay_sketches.merge(SketchTable.load(fname))
+    else:
+        delays = cached_delays(key, compute_delays, recompute=args.recompute)
 
-    # Loading pickle files
-    bgpmonitors = {}
-    for bm_fname in args.bgp_timings:
-        with open(bm_fname, 'rb') as fp:
-            collector = bm_fname.rpartition('_')[2].partition('.')[0]
-            bgpmonitors[collector] = pickle.load(fp)
-
-    bplot = BGPPlot( bgpmonitors, args.roa_timings )
-    bplot.plot_delay_dist()
+    renderer = Renderer(args.nb_proc, args.formats)
+    bplot = BGPPlot( {}, args.roa_timings, delays, renderer, delay_sketches )
+    bplot.plot_delay_dist(args.summary_stats)
+    #bplot.bgpmonitors = load_bgpmonitors()
     #bplot.plot_timeline()
+    renderer.close()
+    print(f'{len(renderer.timings)} figures rendered in '
+        f'{sum(duration for _, duration in renderer.timings):.0f}s (total CPU time)')
 
     # Save stats to files
     ujson.dump(bplot.peer_counts, open('peer_counts.json', 'w'))
+    bplot.sketches.save('delay_sketches.json')
 
     with open('log_long_updates.csv', 'w') as fp:
         for update in bplot.log_long_updates:
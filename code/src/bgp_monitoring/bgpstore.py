@@ -0,0 +1,333 @@
+import arrow
+from array import array
+from collections.abc import Mapping, Sequence
+import datetime
+import numpy as np
+import os
+import ujson
+
+from pathdict import PathDict
+from statelog import StateLog
+
+# Columnar format: one folder per BGPMonitor, one sub-folder per prefix, one
+# .npy file per column. Everything is memory-mapped when loaded.
+#
+# folder/meta.json              prefixes, time range, peers and upstreams tables
+# folder/paths_asns.npy         ASNs of all AS paths (uint32)
+# folder/paths_offsets.npy      start of each path in paths_asns (int64)
+# folder/<prefix>/time.npy      epoch of each log entry (int64)
+# folder/<prefix>/reachability.npy  number of peers (int32)
+# folder/<prefix>/delta_peer.npy    index of the updated peer, -1 if no change (int32)
+# folder/<prefix>/delta_path.npy    new path ID, -1 for withdraws (int32)
+# folder/<prefix>/upstream.npy      peer count for each upstream (int32, entries x upstreams)
+# folder/<prefix>/snapshot_*.npy    full states (index, offsets, peer, path)
+
+NO_VALUE = -1
+
+
+def prefix_dirname(prefix):
+    return prefix.replace('/', '_')
+
+
+def export(bm, folder, collector=None, append=False):
+    """Write the logs of the given BGPMonitor in the columnar format.
+
+    append: add logs to the ones already in folder. The BGPMonitor should 
+    have been resumed from the checkpoint of these logs (same path IDs), its 
+    first log entry (state at the checkpoint time) is skipped.
+    """
+
+    os.makedirs(folder, exist_ok=True)
+
+    meta = {
+            'collector': collector,
+            'starttime': bm.starttime.isoformat(),
+            'peers': [],
+            'upstreams': [],
+            }
+    if append:
+        with open(os.path.join(folder, 'meta.json')) as fp:
+            meta = ujson.load(fp)
+
+    # Tables shared by all prefixes
+    peers = {router: idx for idx, router in enumerate(meta['peers'])}
+    upstreams = {upstream: idx for idx, upstream in enumerate(meta['upstreams'])}
+    for data in bm.log_data.values():
+        for delta in data['delta']:
+            if delta is not None:
+                peers.setdefault(delta[0], len(peers))
+        for state in data['snapshot'].values():
+            for router in state:
+                peers.setdefault(router, len(peers))
+        for datapoint in data['upstream']:
+            for upstream in datapoint:
+                upstreams.setdefault(upstream, len(upstreams))
+
+    meta.update({
+            'endtime': bm.endtime.isoformat(),
+            'my_asns': bm.my_asns,
+            'prefix_list': list(bm.log_data.keys()),
+            'peers': list(peers),
+            'upstreams': list(upstreams),
+            'as_sets': {str(path_id): aspath for path_id, aspath in bm.paths.as_sets.items()},
+            })
+
+    # AS paths dictionary
+    offsets = np.zeros(len(bm.paths)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(path) for path in bm.paths.paths])
+    asns = array('I')
+    for path in bm.paths.paths:
+        asns.extend(path)
+    np.save(os.path.join(folder, 'paths_offsets.npy'), offsets)
+    np.save(os.path.join(folder, 'paths_asns.npy'), np.frombuffer(asns, dtype=np.uint32))
+
+    # Per prefix logs
+    first = 1 if append else 0
+    for prefix, data in bm.log_data.items():
+        prefix_folder = os.path.join(folder, prefix_dirname(prefix))
+        os.makedirs(prefix_folder, exist_ok=True)
+
+        deltas = data['delta'][first:]
+        columns = {
+            'time': np.array([int(t.timestamp()) for t in data['time'][first:]], dtype=np.int64),
+            'reachability': np.array(data['reachability'][first:], dtype=np.int32),
+            'delta_peer': np.array(
+                [NO_VALUE if d is None else peers[d[0]] for d in deltas],
+                dtype=np.int32),
+            'delta_path': np.array(
+                [NO_VALUE if d is None or d[1] is None else d[1] for d in deltas],
+                dtype=np.int32),
+            }
+
+        upstream = np.zeros((len(data['upstream'])-first, len(upstreams)), dtype=np.int32)
+        for idx, datapoint in enumerate(data['upstream'][first:]):
+            for up, count in datapoint.items():
+                upstream[idx, upstreams[up]] = count
+        columns['upstream'] = upstream
+
+        snapshot_idx = sorted(idx for idx in data['snapshot'] if idx >= first)
+        states = [data['snapshot'][idx] for idx in snapshot_idx]
+        columns['snapshot_idx'] = np.array(snapshot_idx, dtype=np.int64)-first
+        columns['snapshot_offsets'] = np.cumsum([0]+[len(state) for state in states], dtype=np.int64)
+        columns['snapshot_peer'] = np.array(
+                [peers[router] for state in states for router in state], dtype=np.int32)
+        columns['snapshot_path'] = np.array(
+                [path_id for state in states for path_id in state.values()], dtype=np.int32)
+
+        if append and os.path.exists(os.path.join(prefix_folder, 'time.npy')):
+            columns = _concat_columns(prefix_folder, columns)
+
+        for name, column in columns.items():
+            np.save(os.path.join(prefix_folder, name+'.npy'), column)
+
+    with open(os.path.join(folder, 'meta.json'), 'w') as fp:
+        ujson.dump(meta, fp)
+
+
+def _concat_columns(prefix_folder, columns):
+    """Append the given columns to the ones stored in prefix_folder"""
+
+    old = { name: np.load(os.path.join(prefix_folder, name+'.npy')) for name in columns }
+
+    # New upstreams are added as new columns
+    old_upstream = np.zeros((len(old['upstream']), columns['upstream'].shape[1]), dtype=np.int32)
+    old_upstream[:, :old['upstream'].shape[1]] = old['upstream']
+    old['upstream'] = old_upstream
+
+    # Shift snapshots indices and offsets
+    columns['snapshot_idx'] = columns['snapshot_idx'] + len(old['time'])
+    columns['snapshot_offsets'] = columns['snapshot_offsets'][1:] + old['snapshot_offsets'][-1]
+
+    return { name: np.concatenate([old[name], column]) for name, column in columns.items() }
+
+
+class DeltaColumn(Sequence):
+    def __init__(self, peers, delta_peer, delta_path):
+        """Read-only list of (router, path ID) deltas backed by numpy arrays"""
+
+        self.peers = peers
+        self.delta_peer = delta_peer
+        self.delta_path = delta_path
+
+    def __len__(self):
+        return len(self.delta_peer)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._delta(peer, path) for peer, path in
+                    zip(self.delta_peer[idx].tolist(), self.delta_path[idx].tolist())]
+
+        return self._delta(int(self.delta_peer[idx]), int(self.delta_path[idx]))
+
+    def _delta(self, peer, path):
+        if peer == NO_VALUE:
+            return None
+
+        return (self.peers[peer], None if path == NO_VALUE else path)
+
+
+class TimeColumn(Sequence):
+    def __init__(self, epochs):
+        """Read-only list of UTC datetimes backed by a numpy array of seconds
+        since epoch, timestamps are converted only when accessed"""
+
+        self.epochs = epochs
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._datetime(t) for t in self.epochs[idx].tolist()]
+
+        return self._datetime(int(self.epochs[idx]))
+
+    @staticmethod
+    def _datetime(t):
+        return datetime.datetime.fromtimestamp(t, datetime.timezone.utc)
+
+
+class UpstreamColumn(Sequence):
+    def __init__(self, upstreams, counts):
+        """Read-only list of upstream counts dictionaries backed by a numpy
+        matrix"""
+
+        self.upstreams = upstreams
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._row(row) for row in self.counts[idx]]
+
+        return self._row(self.counts[idx])
+
+    def _row(self, row):
+        return {self.upstreams[i]: int(count) for i, count in enumerate(row) if count}
+
+
+class PathsColumn(Sequence):
+    def __init__(self, offsets, asns):
+        """Read-only list of AS paths backed by numpy arrays"""
+
+        self.offsets = offsets
+        self.asns = asns
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __getitem__(self, path_id):
+        return self.asns[self.offsets[path_id]:self.offsets[path_id+1]]
+
+
+class LogData(Mapping):
+    def __init__(self, store, prefix_list):
+        """Per prefix logs loaded only when accessed"""
+
+        self.store = store
+        self.prefix_list = prefix_list
+        self.loaded = {}
+
+    def __getitem__(self, prefix):
+        if prefix not in self.prefix_list:
+            raise KeyError(prefix)
+
+        if prefix not in self.loaded:
+            self.loaded[prefix] = self.store.load_prefix(prefix)
+
+        return self.loaded[prefix]
+
+    def __iter__(self):
+        return iter(self.prefix_list)
+
+    def __len__(self):
+        return len(self.prefix_list)
+
+
+class BGPStore(StateLog):
+    def __init__(self, folder, prefix_list=None, starttime=None, endtime=None):
+        """Load BGPMonitor logs written in the columnar format. Files are
+        memory-mapped and prefixes are loaded only when accessed.
+
+        folder: folder given to export()
+        prefix_list: load only these prefixes (default: all)
+        starttime/endtime: load only logs for this period of time (default: all)
+        """
+
+        self.folder = folder
+        with open(os.path.join(folder, 'meta.json')) as fp:
+            self.meta = ujson.load(fp)
+
+        self.collector = self.meta['collector']
+        self.my_asns = self.meta['my_asns']
+        self.peers = self.meta['peers']
+        self.upstreams = self.meta['upstreams']
+
+        self.starttime = arrow.get(self.meta['starttime'])
+        self.endtime = arrow.get(self.meta['endtime'])
+        if starttime is not None:
+            self.starttime = max(self.starttime, arrow.get(starttime))
+        if endtime is not None:
+            self.endtime = min(self.endtime, arrow.get(endtime))
+
+        self.prefix_list = self.meta['prefix_list']
+        if prefix_list is not None:
+            self.prefix_list = [p for p in self.prefix_list if p in prefix_list]
+
+        # Read-only paths dictionary (no reverse index)
+        self.paths = PathDict()
+        self.paths.paths = PathsColumn(self._load('paths_offsets.npy'), self._load('paths_asns.npy'))
+        self.paths.as_sets = {int(path_id): aspath for path_id, aspath in self.meta['as_sets'].items()}
+
+        self.log_data = LogData(self, self.prefix_list)
+
+    def _load(self, *fname):
+        return np.load(os.path.join(self.folder, *fname), mmap_mode='r')
+
+    def load_prefix(self, prefix):
+        """Load logs for the given prefix and the selected period of time"""
+
+        name = prefix_dirname(prefix)
+        time = self._load(name, 'time.npy')
+
+        # Range of log entries for the selected period of time. The first
+        # entry is the state at self.starttime.
+        start_idx = max(0, np.searchsorted(time, int(self.starttime.timestamp()), 'right')-1)
+        end_idx = np.searchsorted(time, int(self.endtime.timestamp()), 'right')
+
+        delta = DeltaColumn(self.peers, self._load(name, 'delta_peer.npy'), self._load(name, 'delta_path.npy'))
+
+        # Snapshots starting in the selected period plus the state at start_idx
+        snapshot_idx = self._load(name, 'snapshot_idx.npy')
+        snapshot_offsets = self._load(name, 'snapshot_offsets.npy')
+        snapshot_peer = self._load(name, 'snapshot_peer.npy')
+        snapshot_path = self._load(name, 'snapshot_path.npy')
+
+        def read_snapshot(i):
+            start, end = snapshot_offsets[i], snapshot_offsets[i+1]
+            return { self.peers[peer]: path for peer, path in
+                    zip(snapshot_peer[start:end].tolist(), snapshot_path[start:end].tolist()) }
+
+        snapshot = {}
+        first = np.searchsorted(snapshot_idx, start_idx, 'right')-1
+        if end_idx > start_idx:
+            state = read_snapshot(first)
+            for d in delta[int(snapshot_idx[first])+1:start_idx+1]:
+                self._apply_delta(state, d)
+            snapshot[0] = state
+
+        for i in range(first+1, np.searchsorted(snapshot_idx, end_idx)):
+            snapshot[int(snapshot_idx[i])-start_idx] = read_snapshot(i)
+
+        selected = slice(start_idx, end_idx)
+        return {
+            'epoch': time[selected],
+            'time': TimeColumn(time[selected]),
+            'reachability': self._load(name, 'reachability.npy')[selected],
+            'upstream': UpstreamColumn(self.upstreams, self._load(name, 'upstream.npy')[selected]),
+            'delta': DeltaColumn(self.peers, delta.delta_peer[selected], delta.delta_path[selected]),
+            'snapshot': snapshot,
+            }
+
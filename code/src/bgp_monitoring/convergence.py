@@ -0,0 +1,157 @@
+import arrow
+from collections import defaultdict
+
+from roaschedule import ROASchedule, to_epoch
+from sketch import SketchTable
+
+
+class ROABins(object):
+    def __init__(self, roa_timings):
+        """Find the ROA action preceding BGP updates.
+
+        roa_timings: CSV files containing ROAs creation and deletion times, or
+        the corresponding ROASchedule.
+        """
+
+        if not isinstance(roa_timings, ROASchedule):
+            roa_timings = ROASchedule(roa_timings)
+
+        # bins[prefix] = [(action, start, end), ...] sorted by start time
+        self.bins = { prefix: list(zip(names.tolist(), to_epoch(starts).tolist(), to_epoch(ends).tolist()))
+                for prefix, (names, starts, ends) in roa_timings.bins.items() }
+        # index of the current bin for each prefix
+        self.current_bin = defaultdict(int)
+
+    def find(self, prefix, timestamp):
+        """Return the (action, start, end) bin containing timestamp for the
+        given prefix, None if there is none. Timestamps should be given in
+        chronological order."""
+
+        prefix = prefix.lower()
+        bins = self.bins.get(prefix)
+        if not bins:
+            return None
+
+        # Move to the first bin ending after timestamp
+        idx = self.current_bin[prefix]
+        while idx < len(bins) and bins[idx][2] < timestamp:
+            idx += 1
+        self.current_bin[prefix] = idx
+
+        if idx < len(bins) and bins[idx][1] < timestamp:
+            return bins[idx]
+
+        return None
+
+
+class ConvergenceDelays(object):
+    def __init__(self, roa_timings, endtime=None):
+        """BGPMonitor operator computing the delay between each ROA action and
+        the first reaction of each peer AS (see BGPMonitor.add_operator).
+
+        A peer reacts to a ROA creation when it starts announcing the prefix
+        and to a ROA deletion when it withdraws it. Only the first reaction
+        of each peer between an action and the next one on the same prefix is
+        kept, flapping in the other direction is ignored.
+
+        roa_timings: CSV files containing ROAs creation and deletion times, or
+        the corresponding ROASchedule.
+        endtime: end of the monitoring period, actions followed by the next 
+        action after endtime are ignored (None for live monitoring).
+        """
+
+        self.bins = ROABins(roa_timings)
+        self.endtime = None if endtime is None else arrow.get(endtime).timestamp()
+        # peers that already reacted: (prefix, bin start) -> set of peers
+        self.reacted = defaultdict(set)
+
+        # (action, prefix, peer, t_action, t_bgp, delay in minutes)
+        self.delays = []
+        # Distribution of delays per (action, peer, prefix)
+        self.sketches = SketchTable()
+
+    def update(self, bm, prefix, router, timestamp, old_path, new_path):
+        """Record the first reaction of peers to ROA actions"""
+
+        bin = self.bins.find(prefix, timestamp)
+        if bin is None:
+            return
+        action, bin_start, bin_end = bin
+        if self.endtime is not None and bin_end > self.endtime:
+            return
+
+        # The peer AS is the first AS on the path
+        old_peer = None if old_path is None else bm.paths[old_path][0]
+        new_peer = None if new_path is None else bm.paths[new_path][0]
+        if old_peer == new_peer:
+            return
+
+        if action == 'create':
+            # Peer AS appeared
+            if new_peer is None or bm.peer_counts[prefix][new_peer] != 1:
+                return
+            peer = new_peer
+        else:
+            # Peer AS disappeared
+            if old_peer is None or old_peer in bm.peer_counts[prefix]:
+                return
+            peer = old_peer
+
+        reacted = self.reacted[(prefix, bin_start)]
+        if peer in reacted:
+            return
+        reacted.add(peer)
+
+        delay = (timestamp-bin_start)/60
+        self.delays.append( (action, prefix, str(peer), bin_start, timestamp, delay) )
+        self.sketches.add( (action, str(peer), prefix), delay )
+
+    def tick(self, bm, timestamp):
+        pass
+
+    def to_csv(self, fname):
+        """Write delays to a CSV file, and their distributions next to it 
+        (see sketches_fname)"""
+
+        write_delays(self.delays, fname)
+        self.sketches.save(sketches_fname(fname))
+
+
+def merge_delays(tables):
+    """Merge delays computed on consecutive periods of time (e.g. shards), 
+    keeping only the first reaction of each peer to each action"""
+
+    first_reaction = {}
+    for table in tables:
+        for row in table:
+            action, prefix, peer, t_action, t_bgp, delay = row
+            key = (action, prefix, peer, t_action)
+            if key not in first_reaction or t_bgp < first_reaction[key][4]:
+                first_reaction[key] = row
+
+    return sorted(first_reaction.values(), key=lambda row: (row[3], row[4]))
+
+
+def sketch_delays(delays):
+    """Return the distribution of delays per (action, peer, prefix)"""
+
+    sketches = SketchTable()
+    for action, prefix, peer, t_action, t_bgp, delay in delays:
+        sketches.add( (action, peer, prefix), delay )
+
+    return sketches
+
+
+def sketches_fname(fname):
+    """Name of the file containing the delay distributions of a CSV file"""
+
+    return fname.rpartition('.csv')[0]+'_sketches.json'
+
+
+def write_delays(delays, fname):
+    """Write a delays table to a CSV file"""
+
+    with open(fname, 'w') as fp:
+        fp.write('action,prefix,peer,t_action,t_bgp,delay_min\n')
+        for action, prefix, peer, t_action, t_bgp, delay in delays:
+            fp.write(f'{action},{prefix},{peer},{arrow.get(t_action)},{arrow.get(t_bgp)},{delay}\n')
@@ -0,0 +1,160 @@
+import appdirs
+import hashlib
+import numpy as np
+import os
+import ujson
+
+from roaschedule import to_epoch
+
+# Tidy table of BGP delays, one row per first reaction of a peer AS to a ROA
+# action. Times are seconds since epoch, paths are the AS paths of the peer
+# at bgp_time (space separated ASNs, paths separated by '|').
+COLUMNS = ['action', 'prefix', 'peer', 'collector', 'bin_start', 'bgp_time',
+        'delay_min', 'path']
+CACHE_VERSION = 2 # increment when the extraction changes
+
+
+def extract_delays(bgpmonitors, roa_schedule, periods={}):
+    """Compute the delay between each ROA action and the first reaction of
+    each peer AS to this action (i.e. peer appearing after a creation and
+    disappearing after a deletion). Returns a table (dictionary of numpy
+    columns, see COLUMNS).
+
+    bgpmonitors: dictionary of BGPMonitor or BGPStore per collector
+    roa_schedule: ROASchedule of ROA actions
+    periods: ignore ROA actions outside of (start, end) for these prefixes
+    """
+
+    rows = []
+    for prefix in roa_schedule.bins:
+        # Retrieve the start/end timings for each ROA create and delete
+        bins = roa_schedule.get_bins(prefix, *periods.get(prefix, (None, None)))
+        if not bins:
+            continue
+
+        # Bins start/end as seconds since epoch
+        bin_epochs = to_epoch([[bin_start, bin_end] for _, bin_start, bin_end in bins])
+
+        for collector, bm in bgpmonitors.items():
+            if prefix not in bm.log_data or not len(bm.log_data[prefix]['time']):
+                continue
+
+            # Find the log entries of all bins at once
+            epochs = bm.get_epochs(prefix)
+            start_indices = np.searchsorted(epochs, bin_epochs[:, 0], 'right')
+            end_indices = np.searchsorted(epochs, bin_epochs[:, 1], 'right')
+            in_log = (bin_epochs[:, 1] >= epochs[0]) & (bin_epochs[:, 1] <= epochs[-1])
+
+            for bin_idx in np.flatnonzero(in_log).tolist():
+                action = bins[bin_idx][0]
+                bin_start = int(bin_epochs[bin_idx, 0])
+                start_idx = int(start_indices[bin_idx])
+                end_idx = int(end_indices[bin_idx])
+                # No state logged before the bin start
+                if start_idx == 0:
+                    continue
+
+                reacted = set()
+                prev_peers = None
+                for time_idx, state in bm.iter_states(prefix, start_idx-1, end_idx):
+                    aspaths = [bm.paths[path_id] for path_id in state.values()]
+                    peers = set([str(path[0]) for path in aspaths])
+                    if prev_peers is None:
+                        prev_peers = peers
+                        continue
+
+                    for updated_peer in prev_peers.symmetric_difference(peers):
+                        # ignore flapping
+                        if (
+                            (action == 'create' and updated_peer in prev_peers and updated_peer not in peers)
+                            or
+                            (action == 'delete' and updated_peer not in prev_peers and updated_peer in peers)
+                            ):
+                            continue
+
+                        if updated_peer in reacted:
+                            continue
+                        reacted.add(updated_peer)
+
+                        bgp_time = int(epochs[time_idx])
+                        path = '|'.join(' '.join(str(asn) for asn in path.tolist())
+                                for path in aspaths if str(path[0]) == updated_peer)
+                        rows.append( (action, prefix, updated_peer, collector,
+                            bin_start, bgp_time, (bgp_time-bin_start)/60, path) )
+
+                    prev_peers = peers
+
+    return to_table(rows)
+
+
+def to_table(rows):
+    """Convert a list of rows to a table (dictionary of numpy columns)"""
+
+    columns = list(zip(*rows)) if rows else [[] for _ in COLUMNS]
+    table = {}
+    for name, column in zip(COLUMNS, columns):
+        if name in ['bin_start', 'bgp_time']:
+            table[name] = np.array(column, dtype=np.int64)
+        elif name == 'delay_min':
+            table[name] = np.array(column, dtype=np.float64)
+        else:
+            table[name] = np.array(column, dtype=str)
+
+    return table
+
+
+def iter_rows(table):
+    """Iterate over the rows of a table as tuples (see COLUMNS)"""
+
+    return zip(*[table[name].tolist() for name in COLUMNS])
+
+
+def save_table(table, fname):
+    """Save a table in a .npz file"""
+
+    tmp_fname = f'{fname}.{os.getpid()}.npz'
+    np.savez(tmp_fname, **table)
+    os.replace(tmp_fname, fname)
+
+
+def load_table(fname):
+    """Load a table saved with save_table"""
+
+    with np.load(fname, allow_pickle=False) as data:
+        return {name: data[name] for name in COLUMNS}
+
+
+def cache_key(fnames, *params):
+    """Key identifying the results computed from the given files (BGPMonitor
+    pickles, columnar folders or CSV files) and parameters"""
+
+    key = hashlib.sha1(str(CACHE_VERSION).encode())
+    for fname in fnames:
+        # Columnar folders are rewritten with their meta.json
+        stat = os.stat(os.path.join(fname, 'meta.json') if os.path.isdir(fname) else fname)
+        key.update(f'{os.path.abspath(fname)},{stat.st_size},{stat.st_mtime_ns}\n'.encode())
+    key.update(ujson.dumps(params).encode())
+
+    return key.hexdigest()[:16]
+
+
+def cached_delays(key, compute, cachedir=None, recompute=False):
+    """Return the delays table cached with the given key. If it is not cached,
+    compute() is called and its result is cached.
+
+    cachedir: default to the user's cache directory
+    recompute: ignore the cached table
+    """
+
+    if cachedir is None:
+        cachedir = appdirs.user_cache_dir('rov-timing', 'IHR')+'/delays'
+    os.makedirs(cachedir, exist_ok=True)
+
+    fname = os.path.join(cachedir, f'delays_{key}.npz')
+    if os.path.exists(fname) and not recompute:
+        return load_table(fname)
+
+    table = compute()
+    save_table(table, fname)
+
+    return table
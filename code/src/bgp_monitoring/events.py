@@ -0,0 +1,51 @@
+class ReachabilityEvents(object):
+    def __init__(self, callback, convergence_time=60):
+        """BGPMonitor operator emitting per-prefix reachability and convergence
+        events (see BGPMonitor.add_operator).
+
+        callback: function called with each event (a dictionary)
+        convergence_time: a prefix is considered converged if its state didn't
+        change for this number of seconds
+        """
+
+        self.callback = callback
+        self.convergence_time = convergence_time
+        # prefix -> [first change, last change, number of changes]
+        self.unstable = {}
+
+    def update(self, bm, prefix, router, timestamp, old_path, new_path):
+        """Emit a reachability event for each change"""
+
+        self.callback({
+            'event': 'reachability',
+            'time': timestamp,
+            'prefix': prefix,
+            'router': router,
+            'aspath': None if new_path is None else bm.paths.to_str(new_path),
+            'reachability': len(bm.monitors[prefix]),
+            })
+
+        if prefix in self.unstable:
+            self.unstable[prefix][1] = timestamp
+            self.unstable[prefix][2] += 1
+        else:
+            self.unstable[prefix] = [timestamp, timestamp, 1]
+
+    def tick(self, bm, timestamp):
+        """Emit a convergence event for prefixes that are stable since
+        convergence_time seconds"""
+
+        for prefix, (first_change, last_change, nb_changes) in list(self.unstable.items()):
+            if timestamp - last_change < self.convergence_time:
+                continue
+
+            self.callback({
+                'event': 'converged',
+                'time': last_change,
+                'prefix': prefix,
+                'start': first_change,
+                'duration': last_change-first_change,
+                'nb_changes': nb_changes,
+                'reachability': len(bm.monitors[prefix]),
+                })
+            del self.unstable[prefix]
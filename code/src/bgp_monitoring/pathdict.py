@@ -0,0 +1,61 @@
+from array import array
+
+AS_SET = 0 # AS_SET segments are stored with the reserved ASN 0
+
+class PathDict(object):
+    def __init__(self):
+        """Dictionary of AS paths. Each distinct AS path is stored once as a
+        compact array of integer ASNs and identified by an integer ID, so two
+        paths are equal if and only if their IDs are equal."""
+
+        self.ids = {}
+        self.paths = []
+        # original string of paths containing AS_SETs (e.g. '2914 {1,2}')
+        self.as_sets = {}
+
+    def intern(self, aspath):
+        """Return the ID of the given AS path (string of space separated ASNs
+        as given by bgpstream). New paths are added to the dictionary."""
+
+        path_id = self.ids.get(aspath)
+        if path_id is not None:
+            return path_id
+
+        path_id = len(self.paths)
+        asns = array('I')
+        for asn in aspath.split(' '):
+            if asn.isdigit():
+                asns.append(int(asn))
+            else:
+                asns.append(AS_SET)
+                self.as_sets[path_id] = aspath
+
+        self.paths.append(asns)
+        self.ids[aspath] = path_id
+
+        return path_id
+
+    def to_str(self, path_id):
+        """Return the AS path corresponding to the given ID as a string"""
+
+        if path_id in self.as_sets:
+            return self.as_sets[path_id]
+
+        return ' '.join(str(asn) for asn in self.paths[path_id])
+
+    def __getitem__(self, path_id):
+        """Return the array of ASNs corresponding to the given ID"""
+
+        return self.paths[path_id]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getstate__(self):
+        # The reverse index is rebuilt when loaded
+        return {'paths': self.paths, 'as_sets': self.as_sets}
+
+    def __setstate__(self, state):
+        self.paths = state['paths']
+        self.as_sets = state['as_sets']
+        self.ids = { self.to_str(path_id): path_id for path_id in range(len(self.paths)) }
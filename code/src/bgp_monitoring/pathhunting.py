@@ -0,0 +1,196 @@
+import arrow
+from collections import Counter, OrderedDict
+
+from convergence import ROABins
+
+MAX_PATHS = 32 # distinct paths counted per episode, see paths_truncated
+FIELDS = ['prefix', 'peer', 'action', 't_action', 'start', 'end', 'duration',
+        'nb_updates', 'nb_withdraws', 'nb_paths', 'paths_truncated', 'min_length',
+        'max_length', 'final_length', 'outcome']
+
+
+def path_length(path):
+    """Number of ASes on the path, prepended ASNs are counted once"""
+
+    length = 0
+    prev = None
+    for asn in path:
+        if asn != prev:
+            length += 1
+            prev = asn
+
+    return length
+
+
+class Episode(object):
+    __slots__ = ['start', 'last', 'bin', 'nb_updates', 'nb_withdraws',
+            'paths', 'truncated', 'final_path', 'min_length', 'max_length']
+
+    def __init__(self, start, bin):
+        """Path exploration of one peer for one prefix"""
+
+        self.start = start
+        self.last = start
+        self.bin = bin
+        self.nb_updates = 0
+        self.nb_withdraws = 0
+        # distinct path IDs seen during the episode (at most MAX_PATHS),
+        # truncated is set if more paths were seen
+        self.paths = set()
+        self.truncated = False
+        # path ID after the last update (None if withdrawn)
+        self.final_path = None
+        self.min_length = None
+        self.max_length = None
+
+
+class PathHunting(object):
+    def __init__(self, roa_timings=None, stable_time=300, fname=None):
+        """BGPMonitor operator detecting path exploration (see
+        BGPMonitor.add_operator).
+
+        An episode starts with a route change of a peer and ends when the peer
+        keeps the same route (or withdraw) for stable_time seconds. Episodes
+        are summarized by their duration, the number of updates and distinct
+        paths, and the length of the explored paths. Only a summary of the
+        ongoing episode is kept for each peer.
+
+        roa_timings: CSV files containing ROAs creation and deletion times (or
+        the corresponding ROASchedule). If given, only episodes starting after
+        a ROA action are kept and episodes end at the next action on the
+        prefix.
+        stable_time: number of seconds without change before an episode ends
+        fname: write episodes to this CSV file as soon as they end, otherwise
+        they are kept in self.episodes
+        """
+
+        self.bins = None if roa_timings is None else ROABins(roa_timings)
+        self.stable_time = stable_time
+
+        # ongoing episodes, (prefix, router) -> Episode, least recently
+        # updated first
+        self.ongoing = OrderedDict()
+        self.lengths = {}
+
+        self.episodes = []
+        self.fp = None
+        if fname is not None:
+            self.fp = open(fname, 'w')
+            self.fp.write(','.join(FIELDS)+'\n')
+
+        # number of episodes per outcome ('withdrawn' or 'stable')
+        self.counts = Counter()
+
+    def update(self, bm, prefix, router, timestamp, old_path, new_path):
+        """Add the change to the peer's ongoing episode"""
+
+        key = (prefix, router)
+        episode = self.ongoing.get(key)
+        bin = None if self.bins is None else self.bins.find(prefix, timestamp)
+
+        if episode is not None and episode.bin != bin:
+            # A new ROA action ends the episode
+            self.close(bm, key, episode.last)
+            episode = None
+
+        if episode is None:
+            if self.bins is not None and bin is None:
+                return
+            episode = Episode(timestamp, bin)
+            self.ongoing[key] = episode
+        else:
+            self.ongoing.move_to_end(key)
+
+        episode.last = timestamp
+        episode.nb_updates += 1
+        episode.final_path = new_path
+        if new_path is None:
+            episode.nb_withdraws += 1
+            return
+
+        if new_path not in episode.paths:
+            if len(episode.paths) < MAX_PATHS:
+                episode.paths.add(new_path)
+            else:
+                episode.truncated = True
+
+        length = self.get_length(bm, new_path)
+        if episode.min_length is None or length < episode.min_length:
+            episode.min_length = length
+        if episode.max_length is None or length > episode.max_length:
+            episode.max_length = length
+
+    def tick(self, bm, timestamp):
+        """End episodes that didn't change for stable_time seconds"""
+
+        while self.ongoing:
+            key, episode = next(iter(self.ongoing.items()))
+            if timestamp - episode.last < self.stable_time:
+                break
+            self.close(bm, key, episode.last)
+
+    def finish(self, bm):
+        """End all ongoing episodes (e.g. at the end of the monitoring period)"""
+
+        for key, episode in list(self.ongoing.items()):
+            self.close(bm, key, episode.last)
+
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def close(self, bm, key, timestamp):
+        """End the episode of the given (prefix, router)"""
+
+        prefix, router = key
+        episode = self.ongoing.pop(key)
+
+        # bm.monitors may already include the update of the next episode
+        if episode.final_path is None:
+            outcome = 'withdrawn'
+            final_length = 0
+        else:
+            outcome = 'stable'
+            final_length = self.get_length(bm, episode.final_path)
+        self.counts[outcome] += 1
+
+        action, t_action = None, None
+        if episode.bin is not None:
+            action, t_action = episode.bin[0], episode.bin[1]
+
+        row = (prefix, router, action, t_action, episode.start, timestamp,
+                timestamp-episode.start, episode.nb_updates, episode.nb_withdraws,
+                len(episode.paths), episode.truncated, episode.min_length,
+                episode.max_length,
+                final_length, outcome)
+
+        if self.fp is None:
+            self.episodes.append(row)
+        else:
+            self.write_rows(self.fp, [row])
+
+    def get_length(self, bm, path_id):
+        """Cached path length"""
+
+        length = self.lengths.get(path_id)
+        if length is None:
+            length = path_length(bm.paths[path_id])
+            self.lengths[path_id] = length
+
+        return length
+
+    def to_csv(self, fname):
+        """Write episodes kept in memory to a CSV file"""
+
+        with open(fname, 'w') as fp:
+            fp.write(','.join(FIELDS)+'\n')
+            self.write_rows(fp, self.episodes)
+
+    @staticmethod
+    def write_rows(fp, rows):
+        for row in rows:
+            prefix, router, action, t_action, start, end = row[:6]
+            fp.write(','.join( [prefix, router, action or '',
+                '' if t_action is None else str(arrow.get(t_action)),
+                str(arrow.get(start)), str(arrow.get(end))]
+                + ['' if value is None else str(value) for value in row[6:]] ) +'\n')
@@ -0,0 +1,210 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import matplotlib
+from matplotlib import pylab as plt
+import numpy as np
+import pickle
+import time
+
+# Default formats of each type of figure
+TIMELINE_FORMATS = ['png']
+STACK_FORMATS = ['png', 'pdf']
+DISTRIBUTION_FORMATS = ['pdf']
+FORMATS = ['png', 'pdf', 'svg', 'pickle']
+# Pixel columns of timelines (20 inches at 100 dpi)
+TIMELINE_RESOLUTION = 2000
+
+
+def savefig(fname, formats):
+    """Save the current figure in the given formats ('pickle' for a pickled
+    matplotlib figure)"""
+
+    for fmt in formats:
+        if fmt == 'pickle':
+            with open(f'{fname}.pickle', 'wb') as fp:
+                pickle.dump(plt.gcf(), fp)
+        else:
+            plt.savefig(f'{fname}.{fmt}')
+
+
+def to_dates(epochs):
+    """Convert seconds since epoch to datetime64 values for the x axis"""
+
+    return np.asarray(epochs, dtype=np.int64).astype('datetime64[s]')
+
+
+def downsample(x, y, nb_columns=TIMELINE_RESOLUTION):
+    """Reduce a step series to at most four points per column (first, last,
+    min and max values) so that it looks the same when drawn nb_columns 
+    pixels wide.
+
+    x: sorted seconds since epoch
+    y: values for each x, or one array of values per series (e.g. stacked 
+    areas), columns keep the extreme values of every series
+
+    Returns the selected x and y.
+    """
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) <= 4*nb_columns:
+        return x, y
+
+    span = max(int(x[-1]-x[0]), 1)
+    columns = ((x-x[0])*nb_columns//(span+1)).astype(np.int64)
+
+    # first and last point of each column
+    boundaries = np.flatnonzero(np.diff(columns))+1
+    selected = [np.concatenate([[0], boundaries]), np.concatenate([boundaries-1, [len(x)-1]])]
+
+    # min and max of each column
+    for series in (y if y.ndim == 2 else [y]):
+        order = np.lexsort((series, columns))
+        selected.append(order[np.concatenate([[0], boundaries])])
+        selected.append(order[np.concatenate([boundaries-1, [len(x)-1]])])
+
+    selected = np.unique(np.concatenate(selected))
+
+    return x[selected], y[..., selected]
+
+
+def timeline_figure(fname, formats, title, x, y, annotations=[]):
+    """Step plot of y as a function of time.
+
+    x: seconds since epoch
+    annotations: list of (seconds since epoch, text) annotated on the x axis
+    """
+
+    plt.figure(figsize=(20,4))
+    plt.title(title)
+    plt.ylabel('# RIS Peers')
+    plt.grid(visible=True, alpha=0.2)
+    plt.xticks(rotation=45)
+    if len(y):
+        plt.ylim( [0, max(y)+1])
+
+    plt.step(to_dates(x), y, where='post')
+
+    for timestamp, text in annotations:
+        plt.annotate(text, xy=(to_dates([timestamp])[0], 0), xytext=(0, 75),
+            textcoords="offset points",
+            ha='center', va='top',
+            arrowprops={'arrowstyle':'->'},
+            fontsize=8
+            )
+
+    plt.tight_layout()
+    savefig(fname, formats)
+    plt.close()
+
+
+def stack_figure(fname, formats, title, ylabel, x, y, labels, step=None):
+    """Stacked areas as a function of time.
+
+    x: seconds since epoch
+    y: one list of values per label
+    step: 'post' to draw y as steps, each value lasting until the next x
+    """
+
+    plt.figure(figsize=(8,3))
+    plt.title(title)
+    plt.ylabel(ylabel)
+    plt.grid(visible=True, alpha=0.2)
+    plt.xticks(rotation=45)
+    plt.stackplot(to_dates(x), y, labels=labels, step=step)
+    plt.legend()
+    plt.tight_layout()
+    savefig(fname, formats)
+    plt.close()
+
+
+def ecdf_figure(fname, formats, title, series, xlim=[0, 60], log_fname=None):
+    """CDF of delays.
+
+    series: list of ((x, y), plot options) pairs, one CDF per pair (see 
+    QuantileSketch.ecdf_points)
+    xlim: limits of the x axis
+    log_fname: if given, the figure is also saved in log scale
+    """
+
+    plt.figure()
+    for (x, y), kwargs in series:
+        plt.plot(x, y, **kwargs)
+
+    plt.grid(visible=True, which='major', alpha=0.35)
+    plt.grid(visible=True, which='minor', linestyle='--', alpha=0.25)
+    plt.title(title)
+    plt.xlabel('Delay (minutes)')
+    plt.ylabel('CDF')
+    plt.legend()
+
+    if log_fname is not None:
+        plt.xscale('log')
+        plt.xlim([1, 800])
+        savefig(log_fname, formats)
+
+    plt.xscale('linear')
+    plt.xlim(xlim)
+    savefig(fname, formats)
+    plt.close()
+
+
+def run_job(job, fname, formats, kwargs):
+    """Render one figure, returns its name and the rendering time"""
+
+    start = time.time()
+    job(fname, formats, **kwargs)
+
+    return fname, time.time()-start
+
+
+def init_worker():
+    matplotlib.use('Agg')
+
+
+class Renderer(object):
+    def __init__(self, nb_proc=1, formats=None):
+        """Render figures in parallel. Figures are described by a job function
+        (e.g. timeline_figure) and the data it needs.
+
+        nb_proc: number of processes, 1 renders figures immediately in the
+        current process
+        formats: formats of all figures (e.g. ['png']), None for the default
+        formats of each figure
+        """
+
+        self.formats = formats
+        self.executor = None
+        if nb_proc > 1:
+            self.executor = ProcessPoolExecutor(max_workers=nb_proc, initializer=init_worker)
+        self.futures = []
+        # (figure name, rendering time)
+        self.timings = []
+
+    def submit(self, job, fname, default_formats, **kwargs):
+        """Render the figure fname with job(fname, formats, **kwargs)"""
+
+        formats = self.formats or default_formats
+        if self.executor is None:
+            self.done(*run_job(job, fname, formats, kwargs))
+        else:
+            self.futures.append(self.executor.submit(run_job, job, fname, formats, kwargs))
+
+    def done(self, fname, duration):
+        self.timings.append( (fname, duration) )
+        print(f'rendered {fname} in {duration:.2f}s')
+
+    def wait(self):
+        """Wait for all submitted figures. Returns the rendering time of each
+        figure."""
+
+        for future in as_completed(self.futures):
+            self.done(*future.result())
+        self.futures = []
+
+        return self.timings
+
+    def close(self):
+        self.wait()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
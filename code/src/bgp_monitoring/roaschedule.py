@@ -0,0 +1,164 @@
+import datetime
+import numpy as np
+import os
+
+ACTIONS = np.array(['create', 'delete'])
+
+
+def parse_times(strings):
+    """Vectorized parsing of times written as '2021-10-07 01:41:52+00:00'.
+    Returns UTC times as a datetime64[s] array."""
+
+    strings = np.array(strings, dtype='U25')
+    times = strings.astype('U19').astype('datetime64[s]')
+
+    # UTC offsets (+HH:MM or -HH:MM), missing offsets are zeros
+    chars = strings.view('U1').reshape(-1, 25)[:, 19:]
+    offset = np.where(np.isin(chars[:, 0], ['+', '-']), 1, 0)
+    if offset.any():
+        digits = np.where(offset[:, None] == 1, chars[:, [1, 2, 4, 5]], '0').astype(np.int64)
+        minutes = (digits[:, 0]*10+digits[:, 1])*60 + digits[:, 2]*10+digits[:, 3]
+        sign = np.where(chars[:, 0] == '-', -1, 1)
+        times = times - (sign*minutes).astype('timedelta64[m]')
+
+    return times
+
+
+def to_epoch(times):
+    """Convert datetime64 values to seconds since epoch"""
+
+    return np.asarray(times, dtype='datetime64[s]').astype(np.int64)
+
+
+def to_datetime(time):
+    """Convert a datetime64 value to a timezone aware datetime"""
+
+    return datetime.datetime.fromtimestamp(int(to_epoch(time)), datetime.timezone.utc)
+
+
+def action_bins(times, actions):
+    """Return the periods of time corresponding to each action of a prefix (ROA
+    actions in the order of the CSV file). An action is followed by a single
+    inverse action, or it is ignored, and its bin ends with this inverse
+    action. If the first action is repeated twice, the first one ends a bin of
+    the inverse action.
+
+    Returns three arrays: actions, start and end times of the bins.
+    """
+
+    if len(actions) < 2:
+        return actions[:0], times[:0], times[:0]
+
+    # Runs of identical actions
+    run_starts = np.concatenate([[0], np.flatnonzero(actions[1:] != actions[:-1])+1])
+    run_lengths = np.diff(np.concatenate([run_starts, [len(actions)]]))
+
+    # The last action of a run is followed by a run of inverse actions
+    valid = np.flatnonzero(run_lengths[1:] == 1)
+    starts = run_starts[valid+1]-1
+    ends = run_starts[valid+1]
+    bin_actions = actions[starts]
+
+    if run_lengths[0] == 2:
+        # The first two actions end a bin of the inverse action
+        inverse = ACTIONS[ACTIONS != actions[0]]
+        bin_actions = np.concatenate([inverse, bin_actions])
+        starts = np.concatenate([[0], starts])
+        ends = np.concatenate([[1], ends])
+
+    return bin_actions, times[starts], times[ends]
+
+
+class ROASchedule(object):
+    def __init__(self, roa_timings):
+        """Index of ROA creation and deletion times. CSV files are read once
+        and actions are stored per prefix in sorted numpy arrays. Prefixes
+        are lower case.
+
+        roa_timings: CSV files containing ROAs creation and deletion times.
+        """
+
+        actions = {}
+        bins = {}
+        for roa_log in roa_timings:
+            if not os.path.getsize(roa_log):
+                continue
+            columns = np.loadtxt(roa_log, delimiter=',', dtype=str, usecols=(0, 1, 2), ndmin=2)
+
+            times = parse_times(columns[:, 0])
+            prefixes = np.char.lower(columns[:, 2])
+
+            for prefix in np.unique(prefixes):
+                selected = prefixes == prefix
+                # Bins are computed independently for each file
+                file_bins = action_bins(times[selected], columns[selected, 1])
+
+                prefix = str(prefix)
+                actions.setdefault(prefix, []).append((times[selected], columns[selected, 1]))
+                bins.setdefault(prefix, []).append(file_bins)
+
+        # actions[prefix] = (times, actions) sorted by time
+        self.actions = {}
+        for prefix, arrays in actions.items():
+            times, names = map(np.concatenate, zip(*arrays))
+            order = np.argsort(times, kind='stable')
+            self.actions[prefix] = (times[order], names[order])
+
+        # bins[prefix] = (actions, starts, ends) sorted by start time
+        self.bins = {}
+        for prefix, arrays in bins.items():
+            names, starts, ends = map(np.concatenate, zip(*arrays))
+            order = np.argsort(starts, kind='stable')
+            self.bins[prefix] = (names[order], starts[order], ends[order])
+
+    @staticmethod
+    def _range(times, start, end):
+        """Indices of times strictly between start and end (None for no
+        limit)"""
+
+        first, last = 0, len(times)
+        if start is not None:
+            first = np.searchsorted(times, np.datetime64(start, 's'), 'right')
+        if end is not None:
+            last = np.searchsorted(times, np.datetime64(end, 's'), 'left')
+
+        return slice(first, max(first, last))
+
+    def get_actions(self, prefix, start=None, end=None):
+        """Return the times and names of ROA actions on the given prefix
+        between start and end (datetime64, datetime, arrow or None)"""
+
+        times, names = self.actions.get(prefix.lower(), (np.array([], dtype='datetime64[s]'), ACTIONS[:0]))
+        selected = self._range(times, _naive(start), _naive(end))
+
+        return times[selected], names[selected]
+
+    def get_bins(self, prefix, start=None, end=None):
+        """Return the list of (action, start, end) periods of time within
+        start and end (datetime64, datetime, arrow or None) for the given 
+        prefix. Each period starts with a ROA action and ends with
+        the next inverse action."""
+
+        if prefix.lower() not in self.bins:
+            return []
+
+        names, starts, ends = self.bins[prefix.lower()]
+        selected = np.ones(len(starts), dtype=bool)
+        if start is not None:
+            selected &= starts >= np.datetime64(_naive(start), 's')
+        if end is not None:
+            selected &= ends <= np.datetime64(_naive(end), 's')
+
+        return list(zip(names[selected].tolist(), starts[selected], ends[selected]))
+
+
+def _naive(time):
+    """datetime64 accepts only naive datetimes, in UTC"""
+
+    if hasattr(time, 'datetime'):
+        # arrow object
+        time = time.datetime
+    if isinstance(time, datetime.datetime) and time.tzinfo is not None:
+        return time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return time
@@ -0,0 +1,214 @@
+import math
+import numpy as np
+import ujson
+
+# Number of points drawn for each CDF
+ECDF_POINTS = 500
+
+
+class QuantileSketch(object):
+    def __init__(self, compression=100):
+        """Mergeable approximation of a distribution (t-digest). Values are
+        summarized by at most a few times compression centroids, with a better
+        accuracy for extreme quantiles. Distributions of less than compression
+        values are kept exactly.
+
+        compression: accuracy/size trade-off
+        """
+
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.buffer = []
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        """Add one value to the distribution"""
+
+        self.buffer.append(value)
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+        if len(self.buffer) >= 5*self.compression:
+            self.compress()
+
+    def update(self, values):
+        """Add values to the distribution"""
+
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Add the values summarized by another sketch"""
+
+        if not other.count:
+            return
+
+        other.compress()
+        self.compress()
+        self.means = np.concatenate([self.means, other.means])
+        self.weights = np.concatenate([self.weights, other.weights])
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress(force=True)
+
+    def _k_limit(self, q):
+        """Quantile up to which a centroid starting at quantile q can grow"""
+
+        k = self.compression/(2*math.pi)*math.asin(2*q-1) + 1
+        if k >= self.compression/4:
+            return 1
+
+        return (math.sin(2*math.pi*k/self.compression)+1)/2
+
+    def compress(self, force=False):
+        """Merge buffered values into centroids"""
+
+        if not self.buffer and not force:
+            return
+
+        means = np.concatenate([self.means, self.buffer])
+        weights = np.concatenate([self.weights, np.ones(len(self.buffer))])
+        self.buffer = []
+
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        if len(means) <= self.compression:
+            self.means, self.weights = means, weights
+            return
+
+        total = weights.sum()
+        new_means, new_weights = [], []
+        cur_mean, cur_weight = means[0], weights[0]
+        weight_before = 0
+        q_limit = self._k_limit(0)
+        for mean, weight in zip(means[1:].tolist(), weights[1:].tolist()):
+            if (weight_before+cur_weight+weight)/total <= q_limit:
+                cur_mean += (mean-cur_mean)*weight/(cur_weight+weight)
+                cur_weight += weight
+            else:
+                new_means.append(cur_mean)
+                new_weights.append(cur_weight)
+                weight_before += cur_weight
+                q_limit = self._k_limit(weight_before/total)
+                cur_mean, cur_weight = mean, weight
+
+        new_means.append(cur_mean)
+        new_weights.append(cur_weight)
+        self.means = np.array(new_means)
+        self.weights = np.array(new_weights)
+
+    def quantile(self, q):
+        """Return the estimated q-quantile (0 <= q <= 1), e.g. q=0.5 for the
+        median. Exact for small distributions (same as np.median)."""
+
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs):
+        """Return the estimated quantiles for all values of qs"""
+
+        if not self.count:
+            return np.full(len(qs), np.nan)
+
+        self.compress()
+        # Centroids are placed at the middle of their weight
+        centers = np.cumsum(self.weights) - self.weights/2
+        positions = np.clip(np.asarray(qs, dtype=float)*self.count, 0, self.count)
+
+        return np.interp(positions,
+                np.concatenate([[0], centers, [self.count]]),
+                np.concatenate([[self.min], self.means, [self.max]]))
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def ecdf_points(self, nb_points=ECDF_POINTS):
+        """Return (x, y) arrays for drawing the cumulative distribution with
+        nb_points points"""
+
+        y = np.linspace(0, 1, nb_points)
+        return self.quantiles(y), y
+
+    def to_dict(self):
+        self.compress()
+        return {
+                'compression': self.compression,
+                'count': self.count,
+                'min': self.min,
+                'max': self.max,
+                'means': self.means.tolist(),
+                'weights': self.weights.tolist(),
+                }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['compression'])
+        sketch.count = data['count']
+        sketch.min = data['min']
+        sketch.max = data['max']
+        sketch.means = np.array(data['means'], dtype=float)
+        sketch.weights = np.array(data['weights'], dtype=float)
+
+        return sketch
+
+
+class SketchTable(object):
+    def __init__(self, compression=100):
+        """Quantile sketches indexed by a tuple of strings (e.g. (action, peer,
+        prefix))"""
+
+        self.compression = compression
+        self.sketches = {}
+
+    def add(self, key, value):
+        """Add value to the sketch of the given key"""
+
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = QuantileSketch(self.compression)
+            self.sketches[key] = sketch
+
+        sketch.add(value)
+
+    def __getitem__(self, key):
+        return self.sketches[key]
+
+    def __setitem__(self, key, sketch):
+        self.sketches[key] = sketch
+
+    def __contains__(self, key):
+        return key in self.sketches
+
+    def items(self):
+        return self.sketches.items()
+
+    def merge(self, other):
+        """Merge the sketches of another table"""
+
+        for key, sketch in other.items():
+            if key not in self.sketches:
+                self.sketches[key] = QuantileSketch(sketch.compression)
+            self.sketches[key].merge(sketch)
+
+    def save(self, fname):
+        """Save all sketches in a JSON file"""
+
+        with open(fname, 'w') as fp:
+            ujson.dump( [ [list(key), sketch.to_dict()] for key, sketch in self.sketches.items() ], fp)
+
+    @classmethod
+    def load(cls, fname):
+        """Load sketches saved with save()"""
+
+        table = cls()
+        with open(fname) as fp:
+            for key, data in ujson.load(fp):
+                table.sketches[tuple(key)] = QuantileSketch.from_dict(data)
+
+        return table
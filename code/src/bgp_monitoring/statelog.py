@@ -0,0 +1,83 @@
+import arrow
+from bisect import bisect_right
+import numpy as np
+
+class StateLog(object):
+    """Access to the monitors state logged in self.log_data. The state is 
+    stored as a list of changes (deltas) plus full snapshots, and AS paths are 
+    IDs referencing self.paths."""
+
+    def get_state(self, prefix, idx=None, timestamp=None):
+        """Reconstruct the state of the monitors (router -> path ID) for the 
+        given prefix at log index idx, or at the last log entry before the 
+        given timestamp. Returns the last state if both are None."""
+
+        data = self.log_data[prefix]
+        if timestamp is not None:
+            idx = bisect_right(data['time'], arrow.get(timestamp).datetime)-1
+            if idx < 0:
+                return {}
+        elif idx is None:
+            idx = len(data['time'])-1
+        elif idx < 0:
+            raise IndexError(f'negative log index {idx} for {prefix}')
+
+        snapshots = sorted(data['snapshot'])
+        snapshot_idx = snapshots[bisect_right(snapshots, idx)-1]
+        state = dict(data['snapshot'][snapshot_idx])
+        for delta in data['delta'][snapshot_idx+1:idx+1]:
+            self._apply_delta(state, delta)
+
+        return state
+
+    def get_epochs(self, prefix):
+        """Return the time of each log entry for the given prefix as a sorted 
+        numpy array of seconds since epoch."""
+
+        data = self.log_data[prefix]
+        if 'epoch' in data:
+            return np.asarray(data['epoch'])
+
+        return np.array([t.timestamp() for t in data['time']], dtype=np.int64)
+
+    def iter_states(self, prefix, start_idx=0, end_idx=None):
+        """Iterate over (index, state) pairs for the given prefix from log 
+        index start_idx to end_idx (excluded). The state dictionary is updated 
+        in place, copy it if it should be kept."""
+
+        data = self.log_data[prefix]
+        if end_idx is None:
+            end_idx = len(data['time'])
+
+        if start_idx >= end_idx:
+            return
+
+        state = self.get_state(prefix, start_idx)
+        yield start_idx, state
+
+        for idx in range(start_idx+1, end_idx):
+            if idx in data['snapshot']:
+                state.clear()
+                state.update(data['snapshot'][idx])
+            else:
+                self._apply_delta(state, data['delta'][idx])
+            yield idx, state
+
+    def get_aspaths(self, prefix, idx=None, timestamp=None):
+        """Return the list of AS paths (arrays of ASNs) seen for the given 
+        prefix at log index idx (or timestamp)."""
+
+        return [self.paths[path_id] for path_id in self.get_state(prefix, idx, timestamp).values()]
+
+    @staticmethod
+    def _apply_delta(state, delta):
+        """Apply a logged change to the given state"""
+
+        if delta is None:
+            return
+
+        router, path_id = delta
+        if path_id is None:
+            state.pop(router, None)
+        else:
+            state[router] = path_id
@@ -0,0 +1,151 @@
+from collections import namedtuple
+import pybgpstream
+import time
+import ujson
+
+FILTER = 'prefix more {}'
+RIS_LIVE_URL = 'wss://ris-live.ripe.net/v1/ws/?client=rov-timing'
+
+# Sources of BGP updates are iterables of Update in chronological order. Live
+# sources may also yield None when no update was received for a while, so that
+# consumers can check timeouts.
+# type is 'R' for RIB entries, 'A' for announcements and 'W' for withdraws.
+# aspath is a string of space separated ASNs, None for withdraws.
+Update = namedtuple('Update', ['time', 'type', 'prefix', 'peer_address', 'aspath'])
+
+
+class BGPStreamSource(object):
+    def __init__(self, prefix_list, starttime, endtime, collector='rrc00',
+            record_type='updates', cachedir=None):
+        """Archived MRT data fetched with pybgpstream.
+
+        prefix_list: list of monitored prefixes (more specific prefixes are also
+        included)
+        starttime/endtime: arrow objects for the period of time to fetch
+        collector: name of the BGP collector
+        record_type: 'updates' or 'ribs'
+        cachedir: where pybgpstream should cache MRT files
+        """
+
+        self.prefix_list = prefix_list
+        self.starttime = starttime
+        self.endtime = endtime
+        self.collector = collector
+        self.record_type = record_type
+        self.cachedir = cachedir
+
+    def __iter__(self):
+        stream = pybgpstream.BGPStream(
+            from_time=int(self.starttime.timestamp()),
+            until_time=int(self.endtime.timestamp()),
+            record_type=self.record_type, collector=self.collector,
+        )
+        if self.cachedir is not None:
+            stream.set_data_interface_option("broker", "cache-dir", self.cachedir)
+
+        # Filter for given prefixes
+        for prefix in self.prefix_list:
+            stream.stream.parse_filter_string(FILTER.format(prefix))
+
+        for elem in stream:
+            yield Update(elem.time, elem.type, elem.fields['prefix'],
+                    elem.peer_address, elem.fields.get('as-path'))
+
+
+class MRTReplaySource(object):
+    def __init__(self, prefix_list, mrt_files, speed=0, record_type='updates'):
+        """Replay local MRT files (e.g. for tests).
+
+        prefix_list: list of monitored prefixes (more specific prefixes are also
+        included)
+        mrt_files: list of MRT files, in chronological order
+        speed: replay speed relative to real time (e.g. 60 replays one hour
+        of updates in one minute). Set to 0 to replay as fast as possible.
+        record_type: 'updates' or 'ribs'
+        """
+
+        self.prefix_list = prefix_list
+        self.mrt_files = mrt_files
+        self.speed = speed
+        self.record_type = record_type
+
+    def __iter__(self):
+        first_update = None
+        replay_start = time.time()
+
+        for mrt_file in self.mrt_files:
+            stream = pybgpstream.BGPStream(data_interface="singlefile")
+            file_type = 'rib-file' if self.record_type == 'ribs' else 'upd-file'
+            stream.set_data_interface_option("singlefile", file_type, mrt_file)
+            for prefix in self.prefix_list:
+                stream.stream.parse_filter_string(FILTER.format(prefix))
+
+            for elem in stream:
+                if self.speed:
+                    # Wait until the update is due
+                    if first_update is None:
+                        first_update = elem.time
+                    wait = (elem.time-first_update)/self.speed - (time.time()-replay_start)
+                    if wait > 0:
+                        time.sleep(wait)
+
+                yield Update(elem.time, elem.type, elem.fields['prefix'],
+                        elem.peer_address, elem.fields.get('as-path'))
+
+
+class RISLiveSource(object):
+    def __init__(self, prefix_list, collector=None, timeout=1, url=RIS_LIVE_URL):
+        """BGP updates streamed by RIS Live (https://ris-live.ripe.net/).
+
+        prefix_list: list of monitored prefixes (more specific prefixes are also
+        included)
+        collector: name of the RIS collector (default: all collectors)
+        timeout: yield None if no message is received for this number of
+        seconds
+        url: RIS Live websocket
+        """
+
+        self.prefix_list = prefix_list
+        self.collector = collector
+        self.timeout = timeout
+        self.url = url
+
+    def __iter__(self):
+        import websocket
+
+        ws = websocket.create_connection(self.url, timeout=self.timeout)
+        for prefix in self.prefix_list:
+            params = { 'prefix': prefix, 'moreSpecific': True, 'type': 'UPDATE' }
+            if self.collector is not None:
+                params['host'] = self.collector
+            ws.send(ujson.dumps({'type': 'ris_subscribe', 'data': params}))
+
+        try:
+            while True:
+                try:
+                    msg = ujson.loads(ws.recv())
+                except websocket.WebSocketTimeoutException:
+                    yield None
+                    continue
+
+                if msg['type'] == 'ris_error':
+                    raise RuntimeError(f"RIS Live error: {msg['data']['message']}")
+
+                if msg['type'] != 'ris_message':
+                    continue
+
+                data = msg['data']
+                for prefix in data.get('withdrawals', []):
+                    yield Update(data['timestamp'], 'W', prefix, data['peer'], None)
+
+                if data.get('announcements'):
+                    # AS_SETs are given as lists
+                    aspath = ' '.join(
+                            '{'+','.join(str(asn) for asn in hop)+'}' if isinstance(hop, list)
+                            else str(hop) for hop in data['path'] )
+
+                    for announce in data['announcements']:
+                        for prefix in announce['prefixes']:
+                            yield Update(data['timestamp'], 'A', prefix, data['peer'], aspath)
+        finally:
+            ws.close()
@@ -1,11 +1,12 @@
 import argparse
 import arrow
 import ujson
-import numpy as np
 from collections import defaultdict
 from matplotlib import pylab as plt
 import os
-import glob
+
+# sketch.py links to the module of the BGP monitoring scripts
+from sketch import QuantileSketch, SketchTable
 
 MAX_DELAY_HOURS = 24 # ROA wiggling should be less than 24h
 MAX_OUT_OF_SYNC = 60 # allow x seconds out-of-sync between user and RIR timestamps
@@ -60,38 +61,18 @@ PREFIX_PROP_FIX = {
         }
 
 
-def ecdf(a, ax=None, add_zero=True, **kwargs):
-    """Plot the Empirical Cumulative Density Function.
-    
-    parameters:
-        a: The data of interest. Should be a list or a 1D numpy array.
-        ax: The axes of the figure.
-        add_zero: Set to True to connect the graph to y=0
-        **kwargs: Any other option to pass to pylab.plot.
-        
-    Returns a dictionary providing the CDF value for each point on the x axis.
-    """
-    sorted=np.sort( a )
-    yvals=np.arange(len(sorted)+1)/float(len(sorted))
-    if add_zero:
-        starti = 0
-        sorted = np.append( sorted[0], sorted )
-    else:
-        starti=1
-    if ax is None:
-        plt.plot( sorted, yvals[starti:], **kwargs )
-    else:
-        ax.plot( sorted, yvals[starti:], **kwargs )
-
-    return {k:v for k,v in zip(sorted, yvals)}
-
-
 class RIRPlot():
-    def __init__(self, pub_timings, userquery_timings ):
+    def __init__(self, pub_timings, userquery_timings, delay_sketches=None):
+        """delay_sketches: SketchTable of delays per (action, prefix) saved by
+        a previous run, if given distributions are plotted from it instead of
+        the user query timings"""
         
         self.pub_timings = pub_timings
         self.prefix = pub_timings.rpartition('.')[0]
         self.userquery_timings = userquery_timings
+        self.delay_sketches = delay_sketches
+        # Distribution of delays per (action, prefix)
+        self.sketches = SketchTable()
 
         # load publication times
         self.pub_log = defaultdict(list)
@@ -118,13 +99,19 @@ class RIRPlot():
         """Plot distibution of delay between user query and signing times"""
         
         
-        # all_delays[create/delete][peer|'all'][prefix]= [...]
+        # all_delays[create/delete][prefix]= QuantileSketch
         all_delays = {
-                'create': defaultdict(list),
-                'delete': defaultdict(list)
+                'create': defaultdict(QuantileSketch),
+                'delete': defaultdict(QuantileSketch)
         }
 
-        for userquery_log in self.userquery_timings:
+        userquery_timings = self.userquery_timings
+        if self.delay_sketches is not None:
+            userquery_timings = []
+            for (action, prefix), sketch in self.delay_sketches.items():
+                all_delays[action][prefix].merge(sketch)
+
+        for userquery_log in userquery_timings:
 
             # Retrieve the start/end timings for each ROA create and delete
             # binned_log[prefix][create][ [start, end], [start,end], ...]
@@ -192,7 +179,7 @@ class RIRPlot():
                                     print( '##### ', bin_start, rir_start, action, 
                                             prefix, PREFIX_PROP[prefix]['label'])
 
-                                all_delays[action][prefix].append( delay_min )
+                                all_delays[action][prefix].add( delay_min )
 
                                 # Remove the timestamp from RIR log to make sure we 
                                 # don't use it twice (may happen with RIPE and APNIC)
@@ -214,19 +201,20 @@ class RIRPlot():
             plt.figure()
 
             max_value = 0
-            for prefix, data in prefix_data.items():
+            for prefix, sketch in prefix_data.items():
+                self.sketches[(action, prefix)] = sketch
 
                 if prefix.lower() in PREFIX_PROP:
                     props = PREFIX_PROP[prefix.lower()]
                 else:
                     continue
 
-                stats[action][props['label']][metric] = np.median(data)
-                print(f'{action} median for {props["label"]}: {np.median(data):.0f}')
+                stats[action][props['label']][metric] = sketch.median()
+                print(f'{action} median for {props["label"]}: {sketch.median():.0f}')
 
-                ecdf(data, label=props['label'], color=props['color'], 
+                plt.plot(*sketch.ecdf_points(), label=props['label'], color=props['color'], 
                         linestyle=props['linestyle'])
-                max_value = np.max([max_value, np.max(data)])
+                max_value = max(max_value, sketch.max)
 
             action_label = ''
             if action == 'create':
@@ -267,10 +255,17 @@ if __name__ == '__main__':
             default=['../apnic/roa_timings.csv','../ripe/roa_timings.csv',
         '../afrinic/roa_timings.csv', '../arin/roa_timings.csv',
         '../lacnic/roa_timings.csv'])
+    parser.add_argument('--sketches',
+            help='Delay sketches saved by a previous run (<pub_timings>_delay_sketches.json), '
+            'if given distributions are plotted from them')
     parser.add_argument('pub_timings', 
             help='Files containing publication times for monitored prefixes.')
 
     args = parser.parse_args()
 
-    bplot = RIRPlot( args.pub_timings, args.roa_timings )
+    delay_sketches = None
+    if args.sketches:
+        delay_sketches = SketchTable.load(args.sketches)
+    bplot = RIRPlot( args.pub_timings, args.roa_timings, delay_sketches )
     bplot.plot_delay_dist()
+    bplot.sketches.save(f'{bplot.prefix}_delay_sketches.json')
@@ -1,11 +1,16 @@
-import arrow
-from collections import defaultdict
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import os
 import sys
 from glob import glob
 import tarfile
+import time
 import ujson
-import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'roa_monitoring'))
+from objectcache import ObjectCache, object_hash
+from roadecoder import ROA, decode_data
+from rpkijson import scan_roas
 
 ROA_URI = [
         #'AFRINIC': 
@@ -20,12 +25,113 @@ ROA_URI = [
         #'RIPE': 
         'eb/6f232e-2275-44e9-91c0-c7397a2669a9/1'
         ]
+PROGRESS_INTERVAL = 10 # seconds between progress reports
+
+
+def extract_members(archive, path, patterns, first_wins=False):
+    """Extract files of a .tgz archive in a single streaming pass, without 
+    reading the list of members first.
+
+    archive: .tgz file
+    path: destination folder
+    patterns: extract members whose name contains one of these strings
+    first_wins: if a name appears multiple times keep the first member,
+    otherwise the last one overwrites the others
+
+    Returns the archive name, its size and the number of extracted files.
+    """
+
+    extracted = set()
+    with tarfile.open(archive, 'r|gz') as tar:
+        for member in tar:
+            if not any(pattern in member.name for pattern in patterns):
+                continue
+            if first_wins and member.name in extracted:
+                continue
+
+            tar.extract(member, path=path)
+            extracted.add(member.name)
+
+    return archive, os.path.getsize(archive), len(extracted)
+
+
+def read_vrps(fname, asn, fix_missing_expires=False):
+    """Read the build time and the ROAs of the given ASN from a json file. 
+    Only records containing the ASN digits are parsed (see 
+    rpkijson.scan_roas).
+
+    fix_missing_expires: replace missing values (e.g. '"expires":,') by "0"
+
+    Returns the build time and the list of ROAs (dictionaries).
+    """
+
+    buildtime, roas = scan_roas(fname, str(asn).encode(), fix_missing_expires)
+
+    return buildtime, [ vrp for vrp in roas if int(vrp['asn']) == asn ]
+
+
+def _extract_job(job):
+    return extract_members(*job)
+
+
+def read_snapshot(archive, cache_fname, first_wins=False):
+    """Read the build time and the ROAs of an archive in a single streaming 
+    pass. ROAs are identified by the SHA-256 of their content, the content
+    is returned only for ROAs missing from the cache.
+
+    archive: .tgz file
+    cache_fname: ObjectCache file
+    first_wins: if a ROA appears multiple times keep the first one, otherwise
+    the last one
+
+    Returns the archive name, its size, the number of ROAs, the build time 
+    (start time of rpki-client.log), the hashes of the ROAs and the ROAs
+    missing from the cache (hash -> (file name, DER bytes)).
+    """
+
+    cache = ObjectCache(cache_fname, readonly=True)
+    buildtime = None
+    # file name -> hash
+    digests = {}
+    unknown = {}
+
+    with tarfile.open(archive, 'r|gz') as tar:
+        for member in tar:
+            if member.name.endswith('/output/rpki-client.log'):
+                # Set publication time to log start time
+                buildtime, _, _ = tar.extractfile(member).readline().decode().partition(' ')
+
+            elif( member.name.endswith('.roa') and 
+                any(directory in member.name for directory in ROA_URI) ):
+                if first_wins and member.name in digests:
+                    continue
+
+                data = tar.extractfile(member).read()
+                digest = object_hash(data)
+                digests[member.name] = digest
+                if digest not in unknown and ('roa', digest) not in cache:
+                    unknown[digest] = (member.name, data)
+
+    cache.close()
+
+    return archive, os.path.getsize(archive), len(digests), buildtime, list(digests.values()), unknown
+
+
+def _snapshot_job(job):
+    return read_snapshot(*job)
+
 
 class RPKI_to_CSV():
-    def __init__(self, dumps_folder, asn, reverse=False):
+    def __init__(self, dumps_folder, asn, reverse=False, nb_proc=1, state_fname=None):
         """ 
         dumps_folder: copy from one of http://www.rpkiviews.org/ vantage point
         asn: extract only timing for the given ASN. All if set to None.
+        reverse: keep the first copy of files appearing multiple times in an
+        archive
+        nb_proc: number of processes reading archives
+        state_fname: enable the incremental mode, this json file keeps the 
+        last processed archive and the VRPs of the last snapshot. Only newer
+        archives are processed and CSV files are appended (see save_state).
         """
 
         self.jsons_folder = './rpki-client-jsons/'
@@ -36,16 +142,89 @@ class RPKI_to_CSV():
 
         self.json_files = []
         self.reverse = reverse
+        self.nb_proc = nb_proc
+
+        self.state_fname = state_fname
+        self.state = {'asn': self.asn, 'last_archive': '', 'vrps': {}}
+        if state_fname is not None and os.path.exists(state_fname):
+            with open(state_fname) as fp:
+                self.state = ujson.load(fp)
+            if self.state['asn'] != self.asn:
+                raise ValueError(f'{state_fname} is the state of AS{self.state["asn"]}')
+        self.last_archive = self.state['last_archive']
+
+    def list_archives(self):
+        """Return the (file, name) of downloaded archives sorted by name. In 
+        incremental mode only archives newer than the last processed one are
+        returned."""
+
+        archives = []
+        for file in glob(self.dumps_folder+'**/*.tgz', recursive=True):
+            tar_fname = file.rpartition('/')[2].replace('.tgz', '')
+            if self.state_fname is not None and tar_fname <= self.state['last_archive']:
+                continue
+            archives.append( (file, tar_fname) )
+
+        archives.sort(key=lambda archive: archive[1])
+        if archives:
+            self.last_archive = max(self.last_archive, archives[-1][1])
+
+        return archives
+
+    def run(self, function, jobs):
+        """Process archives, in parallel if nb_proc > 1, and report progress.
+        Yields the results in the same order as jobs.
+
+        function: called with each job, returns a tuple starting with the 
+        archive name, its size and the number of files read 
+        """
+
+        start = time.time()
+        last_report = start
+        nb_bytes = 0
+        nb_files = 0
+
+        executor = None
+        if self.nb_proc > 1:
+            executor = ProcessPoolExecutor(max_workers=self.nb_proc)
+            results = executor.map(function, jobs, chunksize=4)
+        else:
+            results = map(function, jobs)
+
+        for nb_done, result in enumerate(results, 1):
+            nb_bytes += result[1]
+            nb_files += result[2]
+
+            now = time.time()
+            if now - last_report > PROGRESS_INTERVAL or nb_done == len(jobs):
+                last_report = now
+                duration = max(now - start, 1e-6)
+                print(f'read {nb_done}/{len(jobs)} archives, {nb_files} files '
+                        f'({nb_done/duration:.1f} archives/s, {nb_bytes/duration/1e6:.1f} MB/s)')
+
+            yield result
+
+        if executor is not None:
+            executor.shutdown()
+
+    def extract(self, jobs):
+        """Extract files from archives (see run)
+
+        jobs: list of (archive, patterns) (see extract_members)
+        """
+
+        jobs = [ (archive, self.jsons_folder, patterns, self.reverse) for archive, patterns in jobs ]
+        for _ in self.run(_extract_job, jobs):
+            pass
 
     def extract_rpki_client_jsons(self, overwrite=False, readonly=False):
         """Extract rpki-client.json file for each downloaded archive and populate
         the list of existing json files (self.json_files)"""
 
         self.json_files = []
-        all_tgz = glob(self.dumps_folder+'**/*.tgz', recursive=True)
 
-        for file in all_tgz:
-            tar_fname = file.rpartition('/')[2].replace('.tgz', '')
+        to_extract = []
+        for file, tar_fname in self.list_archives():
             json_fname = tar_fname+'/output/rpki-client.json'
             self.json_files.append(self.jsons_folder+json_fname)
             
@@ -53,22 +232,25 @@ class RPKI_to_CSV():
                 (os.path.exists(self.jsons_folder+json_fname) and not overwrite) ):
                 continue
 
-            with tarfile.open(file) as tar:
-                json_file = tar.getmember(json_fname)
-                print(json_file)
-                tar.extract(json_file, path=self.jsons_folder)
+            to_extract.append( (file, [json_fname]) )
+
+        self.extract(to_extract)
 
-    def extract_roas(self, overwrite=False, readonly=False):
+    def extract_roas(self, overwrite=False, readonly=False, cache=None):
         """Extract ROA data to '{self.asn}.json' files each downloaded archive 
-        and populate the list of existing json files (self.json_files)"""
+        and populate the list of existing json files (self.json_files)
+
+        cache: ObjectCache of decoded ROAs and snapshots, default to the 
+        user's cache
+        """
 
         self.json_files = []
-        all_tgz = glob(self.dumps_folder+'**/*.tgz', recursive=True)
+        if cache is None:
+            cache = ObjectCache()
 
-        for file in all_tgz:
-            tar_fname = file.rpartition('/')[2].replace('.tgz', '')
+        to_read = {}
+        for file, tar_fname in self.list_archives():
             json_fname = tar_fname+f'/output/{self.asn}.json'
-            log_fname = tar_fname+'/output/rpki-client.log'
             self.json_files.append(self.jsons_folder+json_fname)
 
             if ( readonly or 
@@ -76,108 +258,205 @@ class RPKI_to_CSV():
                 ):
                 continue
 
-            if not os.path.exists(self.jsons_folder+log_fname):
-                with tarfile.open(file) as tar:
-                    # Extract all files of interest
-                    to_extract = []
-                    tar_members = tar.getmembers()
-                    if self.reverse:
-                        tar_members.reverse()
-
-                    for file in tar_members:
-                        if( any(directory in file.name for directory in ROA_URI) or
-                            'rpki-client.log' in file.name
-                            ):
-                            to_extract.append(file)
-                    tar.extractall(path=self.jsons_folder, members=to_extract)
-
-            # Set publication time to log start time
-            with open(self.jsons_folder+log_fname,'r') as fp:
-                time, _, _ = fp.readline().partition(' ')
-
-            roas_json = {
-                    'metadata': { "buildtime": time },
-                    'roas': []
-                    }
-
-            # Read ROAs content
-            roas = glob(self.jsons_folder+tar_fname+"/**/*.roa", recursive=True)
-            txt_output = subprocess.run(
-                ["python2", "./print_roa", "--list"] + roas,
-                capture_output=True, text=True)
-
-            for line in txt_output.stdout.splitlines(): 
-
-                sign, not_before, not_after, id, asn, prefix = line.split(" ")
-                if self.asn is not None and int(asn) != self.asn :
+            # Snapshots seen before are rebuilt from the cache, unless some 
+            # of their ROAs were evicted
+            snapshot = cache.get_snapshot(tar_fname)
+            if snapshot is not None:
+                buildtime, digests = snapshot
+                roas = cache.get_many('roa', digests)
+                if len(roas) == len(set(digests)):
+                    cache.touch('roa', digests)
+                    self.write_roas(json_fname, buildtime, digests, roas)
                     continue
 
+            to_read[file] = (tar_fname, json_fname)
+
+        # Read all archives, ROAs are decoded here so that ROAs found in 
+        # archives read in parallel are decoded only once
+        jobs = [ (file, cache.fname, self.reverse) for file in to_read ]
+        for file, _, _, buildtime, digests, unknown in self.run(_snapshot_job, jobs):
+            decoded = {}
+            for digest, (name, data) in unknown.items():
+                if ('roa', digest) in cache:
+                    continue
+                roa = decode_data(data, name)
+                decoded[digest] = None if roa is None else roa.to_list()
+            cache.put_many('roa', decoded)
+
+            tar_fname, json_fname = to_read[file]
+            if buildtime is None:
+                print(f'Error: no rpki-client.log in {file}\n')
+                continue
+
+            cache.put_snapshot(tar_fname, buildtime, digests)
+            roas = cache.get_many('roa', digests)
+            cache.touch('roa', digests)
+            roas.update(decoded)
+            self.write_roas(json_fname, buildtime, digests, roas)
+
+    def write_roas(self, json_fname, buildtime, digests, roas):
+        """Write the ROAs of a snapshot to a json file
+
+        digests: hashes of the snapshot ROAs
+        roas: decoded ROAs, hash -> ROA.to_list()
+        """
+
+        roas_json = {
+                'metadata': { "buildtime": buildtime },
+                'roas': []
+                }
+
+        for digest in digests:
+            if roas.get(digest) is None:
+                continue
+
+            roa = ROA.from_list(roas[digest])
+            if self.asn is not None and roa.asn != self.asn :
+                continue
+
+            for prefix in roa.formatted_prefixes():
                 roas_json['roas'].append( 
                         {
-                            "expires": int(id), "time": time, "asn": int(asn), 
-                            "prefix": prefix, "sign": sign, 
-                            "not_before": not_before, "not_after": not_after
+                            "expires": roa.serial, "time": buildtime, "asn": roa.asn, 
+                            "prefix": prefix, "sign": roa.signing_time, 
+                            "not_before": roa.not_before, "not_after": roa.not_after
                         } )
 
-            # Write json file
-            with open(self.jsons_folder+json_fname, 'w') as fp:
-                ujson.dump(roas_json, fp)
+        # Write json file
+        os.makedirs(os.path.dirname(self.jsons_folder+json_fname), exist_ok=True)
+        with open(self.jsons_folder+json_fname, 'w') as fp:
+            ujson.dump(roas_json, fp)
+
+    def convert(self, outputs, key='', fix_missing_expires=None):
+        """Write ROA creation and revocation times to CSV files. All outputs
+        are written in a single pass over the json files.
+
+        outputs: list of (CSV file, key) where key is the json field used as
+        creation time, or '' for the snapshot build time. A single CSV file 
+        name is also accepted, with the given key.
+        fix_missing_expires: fix json files with missing expire values, by
+        default only for outputs named pub, sign or not_before
+
+        In incremental mode CSV files are appended and the first snapshot is
+        compared to the last snapshot of the previous run.
+        """
+
+        if isinstance(outputs, str):
+            outputs = [ (outputs, key) ]
+        if fix_missing_expires is None:
+            fix_missing_expires = any( 'pub' in outputfile or 'sign' in outputfile 
+                    or 'not_before' in outputfile for outputfile, _ in outputs )
+        keys = set( key for _, key in outputs if key )
 
-    def convert(self, outputfile, key=''):
         # Make sure the list of files is sorted
         self.json_files.sort()
         previous_vrps = set()
+        mode = 'w'
+        state_key = ','.join( outputfile for outputfile, _ in outputs )
+        # Append only to CSV files written by a previous incremental run
+        if self.state['last_archive'] and state_key in self.state['vrps']:
+            previous_vrps = set( tuple(vrp) for vrp in self.state['vrps'][state_key] )
+            mode = 'a'
 
         print(f'{len(self.json_files)} json files to process')
-        with open(outputfile, 'w') as csv:
-            for current_file in self.json_files:
+        csvs = [ (open(outputfile, mode), key) for outputfile, key in outputs ]
+        for current_file in self.json_files:
 
-                # fetch active vrps
-                current_vrps = set()
-                try:
-                    with open(current_file) as fp:
-                        payload = fp.read()
-                        if 'pub' in outputfile or 'sign' in outputfile or 'not_before' in outputfile:
-                            # fix: missing expire value
-                            payload = payload.replace(':,', ':"0",')
-
-                        vrps = ujson.loads(payload)
-                        current_timestamp = vrps['metadata']['buildtime']
-                        key_ts = {}
-                        for vrp in vrps['roas']:
-                            if int(vrp['asn']) == self.asn:
-                                current_vrps.add( (vrp['prefix'], vrp['expires']) )
-                                if key:
-                                    key_ts[(vrp['prefix'],vrp['expires'])] = vrp[key]
-
-                except FileNotFoundError:
-                    print(f'Error: could not open {current_file}\n')
-                    continue
+            # fetch active vrps
+            current_vrps = set()
+            try:
+                # fix: missing expire value
+                current_timestamp, vrps = read_vrps(current_file, self.asn, fix_missing_expires)
+                key_ts = { key: {} for key in keys }
+                for vrp in vrps:
+                    current_vrps.add( (vrp['prefix'], vrp['expires']) )
+                    for key in keys:
+                        key_ts[key][(vrp['prefix'],vrp['expires'])] = vrp[key]
 
-                # diff with previous vrps
-                if previous_vrps:
-                    for prefix in previous_vrps.union(current_vrps):
-                        # Revoked ROA
-                        if prefix in previous_vrps and prefix not in current_vrps:
+            except FileNotFoundError:
+                print(f'Error: could not open {current_file}\n')
+                continue
+
+            # diff with previous vrps
+            if previous_vrps:
+                for prefix in previous_vrps.union(current_vrps):
+                    # Revoked ROA
+                    if prefix in previous_vrps and prefix not in current_vrps:
+                        for csv, _ in csvs:
                             csv.write(f'{prefix[0]},{current_timestamp},revoke\n')
 
-                        # New ROA
-                        if prefix not in previous_vrps and prefix in current_vrps:
+                    # New ROA
+                    if prefix not in previous_vrps and prefix in current_vrps:
+                        for csv, key in csvs:
                             if key:
-                                csv.write(f'{prefix[0]},{key_ts[prefix]},create\n')
+                                csv.write(f'{prefix[0]},{key_ts[key][prefix]},create\n')
                             else:
                                 csv.write(f'{prefix[0]},{current_timestamp},create\n')
 
-                previous_vrps = current_vrps
-                
+            previous_vrps = current_vrps
+
+        for csv, _ in csvs:
+            csv.close()
+
+        self.state['vrps'][state_key] = sorted(previous_vrps, key=str)
+
+    def save_state(self):
+        """Save the last processed archive and the VRPs of the last snapshot
+        (incremental mode only). Call it once all CSV files are written, the
+        next run starts after this archive."""
+
+        if self.state_fname is None:
+            return
+
+        self.state['last_archive'] = self.last_archive
+        with open(self.state_fname+'.tmp', 'w') as fp:
+            ujson.dump(self.state, fp)
+        os.replace(self.state_fname+'.tmp', self.state_fname)
+
+    def prune_json_files(self):
+        """Delete the json files listed in self.json_files, and their folders
+        if empty, once they are converted"""
+
+        jsons_folder = os.path.abspath(self.jsons_folder)
+        for json_fname in self.json_files:
+            if os.path.exists(json_fname):
+                os.remove(json_fname)
+
+            folder = os.path.dirname(os.path.abspath(json_fname))
+            while folder.startswith(jsons_folder+os.sep):
+                try:
+                    os.rmdir(folder)
+                except OSError:
+                    break
+                folder = os.path.dirname(folder)
+
+
 if __name__ == '__main__':
-    if len(sys.argv) < 3:
-        print('usage: {sys.argv[0]} rpkiviews_dumps/ asn')
-        
-    rtc = RPKI_to_CSV(sys.argv[1], sys.argv[2], reverse=False)
+    parser = argparse.ArgumentParser(
+            description='Compute ROA creation and revocation times from rpkiviews archives')
+    parser.add_argument('dumps_folder', help='folder of rpkiviews archives (.tgz)')
+    parser.add_argument('asn', help='extract timing for this ASN')
+    parser.add_argument('nb_proc', type=int, nargs='?', default=os.cpu_count(),
+            help='number of processes reading archives')
+    parser.add_argument('--state',
+            help='incremental mode: process only archives newer than the ones '
+            'recorded in this file and append to the CSV files')
+    parser.add_argument('--prune', action='store_true',
+            help='delete extracted json files once converted')
+    args = parser.parse_args()
+
+    rtc = RPKI_to_CSV(args.dumps_folder, args.asn, reverse=False, nb_proc=args.nb_proc,
+            state_fname=args.state)
     rtc.extract_rpki_client_jsons()
     rtc.convert('rp_timings.csv')
+    if args.prune:
+        rtc.prune_json_files()
     rtc.extract_roas()
-    rtc.convert('pub_timings.csv')
-    rtc.convert('sign_timings.csv', key='sign')
-    rtc.convert('not_before_timings.csv', key='not_before')
+    rtc.convert([ 
+        ('pub_timings.csv', ''), 
+        ('sign_timings.csv', 'sign'), 
+        ('not_before_timings.csv', 'not_before'),
+        ], fix_missing_expires=True)
+    if args.prune:
+        rtc.prune_json_files()
+    rtc.save_state()
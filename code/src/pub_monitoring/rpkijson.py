@@ -0,0 +1,88 @@
+import re
+import ujson
+
+CHUNK_SIZE = 1 << 22 # bytes read at once from json files
+BUILDTIME = re.compile(rb'"buildtime"\s*:\s*"([^"]*)"')
+ROAS_ARRAY = re.compile(rb'"roas"\s*:\s*\[')
+MISSING_VALUE = re.compile(rb':\s*,')
+
+
+def scan_roas(fname, needle=None, fix_missing_values=False, chunk_size=CHUNK_SIZE):
+    """Read the ROAs of a json file (rpki-client.json or files written by
+    RPKI_to_CSV.extract_roas) chunk by chunk, the whole file is never loaded
+    in memory.
+
+    needle: if given, only records containing these bytes are parsed (e.g.
+    the digits of an ASN)
+    fix_missing_values: replace missing values (e.g. '"expires":,') by "0"
+
+    Returns the build time of the snapshot and an iterator over the ROAs
+    (dictionaries).
+    """
+
+    fp = open(fname, 'rb')
+
+    # Find the beginning of the roas array, metadata are before
+    buffer = b''
+    start = -1
+    while start == -1:
+        chunk = fp.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        # "roas" is also a counter in the metadata of rpki-client.json
+        roas_array = ROAS_ARRAY.search(buffer)
+        if roas_array is not None:
+            start = roas_array.end()-1
+
+    match = BUILDTIME.search(buffer, 0, max(start, 0))
+    if start == -1 or match is None:
+        # Unusual layout, parse the whole file
+        fp.seek(0)
+        payload = fp.read()
+        fp.close()
+        if fix_missing_values:
+            payload = MISSING_VALUE.sub(b':"0",', payload)
+        vrps = ujson.loads(payload)
+
+        return vrps['metadata']['buildtime'], iter(vrps['roas'])
+
+    return match.group(1).decode(), _iter_records(fp, buffer[start+1:], needle,
+            fix_missing_values, chunk_size)
+
+
+def _iter_records(fp, buffer, needle, fix_missing_values, chunk_size):
+    """Parse the records of the roas array, buffer starts after '['"""
+
+    with fp:
+        while True:
+            # ROA records are flat objects, the array ends with the first ']'
+            end = buffer.find(b']')
+            complete = end if end != -1 else buffer.rfind(b'}')+1
+
+            if needle is None:
+                # Parse all complete records at once
+                records = buffer[:complete].strip().lstrip(b',')
+                if records:
+                    if fix_missing_values:
+                        records = MISSING_VALUE.sub(b':"0",', records)
+                    yield from ujson.loads(b'['+records+b']')
+            else:
+                pos = buffer.find(needle, 0, complete)
+                while pos != -1:
+                    record_start = buffer.rfind(b'{', 0, pos)
+                    record_end = buffer.find(b'}', pos, complete)+1
+                    record = buffer[record_start:record_end]
+                    if fix_missing_values:
+                        record = MISSING_VALUE.sub(b':"0",', record)
+                    yield ujson.loads(record)
+
+                    pos = buffer.find(needle, record_end, complete)
+
+            if end != -1:
+                break
+
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            buffer = buffer[complete:] + chunk
@@ -0,0 +1 @@
+../bgp_monitoring/sketch.py
\ No newline at end of file
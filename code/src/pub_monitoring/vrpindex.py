@@ -0,0 +1,174 @@
+import argparse
+from glob import glob
+import os
+import sqlite3
+import time
+
+from rpkijson import scan_roas
+
+
+def snapshot_name(json_fname):
+    """Name of the archive a rpki-client.json file was extracted from (e.g.
+    rpki-client-jsons/rpki-20220101T000000/output/rpki-client.json)"""
+
+    return os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(json_fname))))
+
+
+class VRPIndex(object):
+    def __init__(self, fname='vrp_index.sqlite'):
+        """Change log of all VRPs found in a sequence of rpki-client.json
+        snapshots. Each VRP (asn, prefix, maxLength, ta) is stored with the
+        intervals of consecutive snapshots where it was seen (first_seen,
+        last_seen), so VRPs of any ASN, prefix or TA are retrieved without
+        reading the snapshots again. Only changes are written when a snapshot
+        is appended, intervals of VRPs still present have no last_seen.
+
+        fname: sqlite file of the index
+        """
+
+        self.db = sqlite3.connect(fname)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS snapshots (
+                id INTEGER PRIMARY KEY, name TEXT UNIQUE, buildtime TEXT );
+            CREATE TABLE IF NOT EXISTS vrps (
+                id INTEGER PRIMARY KEY, asn INTEGER, prefix TEXT, max_length INTEGER,
+                ta TEXT, UNIQUE (asn, prefix, max_length, ta) );
+            CREATE INDEX IF NOT EXISTS vrps_prefix ON vrps (prefix);
+            CREATE INDEX IF NOT EXISTS vrps_ta ON vrps (ta);
+            CREATE TABLE IF NOT EXISTS intervals (
+                vrp_id INTEGER, first_seen INTEGER, last_seen INTEGER );
+            CREATE INDEX IF NOT EXISTS intervals_vrp ON intervals (vrp_id);
+            CREATE INDEX IF NOT EXISTS intervals_last_seen ON intervals (last_seen);
+            ''')
+        self.db.commit()
+
+        # VRPs of the last snapshot, (asn, prefix, max_length, ta) -> interval ID
+        self.last_snapshot = self.db.execute('SELECT MAX(id) FROM snapshots').fetchone()[0]
+        self.active = { tuple(row[1:]): row[0] for row in self.db.execute(
+            '''SELECT intervals.rowid, asn, prefix, max_length, ta FROM vrps
+            JOIN intervals ON vrps.id = intervals.vrp_id WHERE last_seen IS NULL''') }
+
+    def __contains__(self, name):
+        """True if the snapshot is already indexed"""
+
+        return self.db.execute('SELECT 1 FROM snapshots WHERE name=?', (name,)).fetchone() is not None
+
+    def append(self, json_fname, name=None):
+        """Add a snapshot to the index. Snapshots should be appended in
+        chronological order, already indexed snapshots are ignored.
+
+        json_fname: rpki-client.json file
+        name: snapshot name, default to the name of the archive (see
+        snapshot_name)
+
+        Returns False if the snapshot was already indexed.
+        """
+
+        if name is None:
+            name = snapshot_name(json_fname)
+        if name in self:
+            return False
+
+        buildtime, roas = scan_roas(json_fname, fix_missing_values=True)
+        current = set( (int(vrp['asn']), vrp['prefix'], vrp.get('maxLength'), vrp.get('ta'))
+                for vrp in roas )
+
+        cursor = self.db.execute('INSERT INTO snapshots (name, buildtime) VALUES (?, ?)',
+                (name, buildtime))
+        snapshot = cursor.lastrowid
+
+        # Close intervals of removed VRPs
+        removed = [ vrp for vrp in self.active if vrp not in current ]
+        self.db.executemany('UPDATE intervals SET last_seen=? WHERE rowid=?',
+                [ (self.last_snapshot, self.active.pop(vrp)) for vrp in removed ])
+
+        # Open intervals for new VRPs
+        for vrp in current:
+            if vrp in self.active:
+                continue
+
+            row = self.db.execute('''SELECT id FROM vrps WHERE asn=? AND prefix=?
+                AND max_length IS ? AND ta IS ?''', vrp).fetchone()
+            if row is None:
+                vrp_id = self.db.execute('''INSERT INTO vrps (asn, prefix, max_length, ta)
+                    VALUES (?, ?, ?, ?)''', vrp).lastrowid
+            else:
+                vrp_id = row[0]
+
+            self.active[vrp] = self.db.execute('''INSERT INTO intervals VALUES (?, ?, NULL)''',
+                    (vrp_id, snapshot)).lastrowid
+
+        self.db.commit()
+        self.last_snapshot = snapshot
+
+        return True
+
+    def build(self, json_files):
+        """Append all snapshots that are not indexed yet (see append)"""
+
+        json_files = sorted(json_files, key=snapshot_name)
+        start = time.time()
+        nb_new = 0
+        for json_fname in json_files:
+            try:
+                if self.append(json_fname):
+                    nb_new += 1
+            except (FileNotFoundError, ValueError) as error:
+                print(f'Error: could not index {json_fname}: {error}\n')
+
+        print(f'indexed {nb_new} new snapshots in {time.time()-start:.1f}s, '
+                f'{len(self.active)} VRPs in the last snapshot')
+
+    def query(self, asn=None, prefix=None, ta=None):
+        """Return the VRPs matching all the given criteria with the periods
+        when they were seen, as a list of (asn, prefix, max_length, ta,
+        first_seen, last_seen). first_seen and last_seen are build times of
+        the snapshots."""
+
+        conditions = []
+        params = []
+        for column, value in [('asn', asn), ('prefix', prefix), ('ta', ta)]:
+            if value is not None:
+                conditions.append(f'{column}=?')
+                params.append(value)
+
+        where = ('WHERE '+' AND '.join(conditions)) if conditions else ''
+        # VRPs still present were last seen in the last snapshot
+        return self.db.execute(f'''SELECT asn, prefix, max_length, ta,
+                first.buildtime, last.buildtime FROM vrps
+                JOIN intervals ON vrps.id = intervals.vrp_id
+                JOIN snapshots AS first ON first.id = intervals.first_seen
+                JOIN snapshots AS last ON last.id = 
+                    COALESCE(intervals.last_seen, (SELECT MAX(id) FROM snapshots))
+                {where} ORDER BY intervals.first_seen''', params).fetchall()
+
+    def snapshots(self):
+        """Return the list of (name, build time) of indexed snapshots"""
+
+        return self.db.execute('SELECT name, buildtime FROM snapshots ORDER BY id').fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description='Index VRPs of rpki-client.json snapshots and query the index')
+    parser.add_argument('--index', default='vrp_index.sqlite',
+            help='sqlite file of the index')
+    parser.add_argument('--jsons',
+            help='folder of rpki-client.json files to add to the index (see RPKI_to_CSV.extract_rpki_client_jsons)')
+    parser.add_argument('--asn', type=int, help='show VRPs of this ASN')
+    parser.add_argument('--prefix', help='show VRPs of this prefix')
+    parser.add_argument('--ta', help='show VRPs of this trust anchor')
+    args = parser.parse_args()
+
+    index = VRPIndex(args.index)
+    if args.jsons:
+        index.build(glob(os.path.join(args.jsons, '**/rpki-client.json'), recursive=True))
+
+    if args.asn is not None or args.prefix or args.ta:
+        for row in index.query(args.asn, args.prefix, args.ta):
+            print(','.join('' if value is None else str(value) for value in row))
+
+    index.close()
@@ -0,0 +1,155 @@
+import appdirs
+import hashlib
+import os
+import sqlite3
+import time
+import ujson
+
+DEFAULT_MAX_SIZE = 1 << 30 # bytes of decoded objects kept in the cache
+
+
+def default_fname():
+    """Cache file shared by all scripts"""
+
+    cachedir = appdirs.user_cache_dir('rov-timing', 'IHR')
+    os.makedirs(cachedir, exist_ok=True)
+
+    return os.path.join(cachedir, 'rpki_objects.sqlite')
+
+
+def object_hash(data):
+    """SHA-256 of the DER bytes of an object"""
+
+    return hashlib.sha256(data).digest()
+
+
+class ObjectCache(object):
+    def __init__(self, fname=None, max_size=DEFAULT_MAX_SIZE, readonly=False):
+        """Persistent cache of decoded RPKI objects (ROA, CRL, ...) indexed by
+        the SHA-256 of their DER bytes, so identical objects found in different
+        snapshots are decoded only once. Decoded values are JSON serializable
+        (None for objects that can't be decoded). The cache also keeps the
+        list of object hashes of each snapshot.
+
+        fname: sqlite file, default to the user's cache directory
+        max_size: the least recently used objects are dropped when the decoded
+        values exceed this size (in bytes)
+        readonly: open the cache only for lookups (e.g. in worker processes)
+        """
+
+        self.fname = default_fname() if fname is None else fname
+        self.max_size = max_size
+
+        if readonly:
+            self.db = sqlite3.connect(f'file:{self.fname}?mode=ro', uri=True)
+            return
+
+        self.db = sqlite3.connect(self.fname)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS objects (
+            hash BLOB, kind TEXT, value TEXT, size INTEGER, last_used REAL,
+            PRIMARY KEY (hash, kind) )''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS objects_last_used ON objects (last_used)')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS snapshots (
+            name TEXT PRIMARY KEY, buildtime TEXT, hashes BLOB )''')
+        self.db.commit()
+
+        # total size of the decoded values
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+
+    def get_many(self, kind, digests):
+        """Return the decoded value of the cached objects of the given kind
+        ('roa', 'crl', ...) as a dictionary (hash -> value)"""
+
+        values = {}
+        for digest in set(digests):
+            row = self.db.execute('SELECT value FROM objects WHERE hash=? AND kind=?',
+                    (digest, kind)).fetchone()
+            if row is not None:
+                values[digest] = ujson.loads(row[0])
+
+        return values
+
+    def get(self, kind, digest, default=None):
+        return self.get_many(kind, [digest]).get(digest, default)
+
+    def __contains__(self, key):
+        """key: (kind, hash)"""
+
+        kind, digest = key
+        return self.db.execute('SELECT 1 FROM objects WHERE hash=? AND kind=?',
+                (digest, kind)).fetchone() is not None
+
+    def touch(self, kind, digests):
+        """Mark objects as recently used"""
+
+        now = time.time()
+        self.db.executemany('UPDATE objects SET last_used=? WHERE hash=? AND kind=?',
+                [ (now, digest, kind) for digest in set(digests) ])
+        self.db.commit()
+
+    def put_many(self, kind, values):
+        """Add decoded values (dictionary hash -> value) to the cache, objects
+        already cached are ignored"""
+
+        if not values:
+            return
+
+        now = time.time()
+        rows = []
+        for digest, value in values.items():
+            if (kind, digest) in self:
+                continue
+            value = ujson.dumps(value)
+            rows.append( (digest, kind, value, len(value), now) )
+            self.size += len(value)
+
+        self.db.executemany('INSERT INTO objects VALUES (?, ?, ?, ?, ?)', rows)
+        self.db.commit()
+        self.evict()
+
+    def put(self, kind, digest, value):
+        self.put_many(kind, {digest: value})
+
+    def evict(self):
+        """Drop the least recently used objects if the cache is too large"""
+
+        if self.size <= self.max_size:
+            return
+
+        # Free some space to not evict objects at each insertion
+        to_free = self.size - 0.9*self.max_size
+        freed = 0
+        to_delete = []
+        for digest, kind, obj_size in self.db.execute(
+                'SELECT hash, kind, size FROM objects ORDER BY last_used'):
+            to_delete.append( (digest, kind) )
+            freed += obj_size
+            if freed >= to_free:
+                break
+
+        self.db.executemany('DELETE FROM objects WHERE hash=? AND kind=?', to_delete)
+        self.db.commit()
+        self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+
+    def get_snapshot(self, name):
+        """Return the build time and object hashes of a snapshot, or None if
+        the snapshot is unknown"""
+
+        row = self.db.execute('SELECT buildtime, hashes FROM snapshots WHERE name=?',
+                (name,)).fetchone()
+        if row is None:
+            return None
+
+        buildtime, hashes = row
+        return buildtime, [ hashes[i:i+32] for i in range(0, len(hashes), 32) ]
+
+    def put_snapshot(self, name, buildtime, digests):
+        """Save the list of object hashes of a snapshot"""
+
+        self.db.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)',
+                (name, buildtime, b''.join(digests)))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,310 @@
+from concurrent.futures import ProcessPoolExecutor
+import ipaddress
+import sys
+
+from objectcache import object_hash
+
+# DER tags
+INTEGER = 0x02
+BIT_STRING = 0x03
+OCTET_STRING = 0x04
+UTC_TIME = 0x17
+GENERALIZED_TIME = 0x18
+SEQUENCE = 0x30
+SET = 0x31
+CONTEXT_0 = 0xa0
+
+# DER encoded value of the signingTime attribute OID (1.2.840.113549.1.9.5)
+SIGNING_TIME_OID = bytes([0x2a, 0x86, 0x48, 0x86, 0xf7, 0x0d, 0x01, 0x09, 0x05])
+# Address families of ROAIPAddressFamily
+AFI_IPV4 = b'\x00\x01'
+AFI_IPV6 = b'\x00\x02'
+
+
+class ROA(object):
+    __slots__ = ['signing_time', 'serial', 'not_before', 'not_after', 'asn',
+            'prefixes']
+
+    def __init__(self, signing_time, serial, not_before, not_after, asn, prefixes):
+        """Content of a ROA. Times are written as '2022-01-01T00:00:00Z'.
+
+        signing_time: signingTime attribute of the CMS signature
+        serial, not_before, not_after: serial number and validity of the EE
+        certificate
+        asn: origin AS (asID)
+        prefixes: list of (prefix, maxLength), maxLength is None if not given
+        """
+
+        self.signing_time = signing_time
+        self.serial = serial
+        self.not_before = not_before
+        self.not_after = not_after
+        self.asn = asn
+        self.prefixes = prefixes
+
+    def formatted_prefixes(self):
+        """Prefixes written as 'prefix' or 'prefix-maxLength' (e.g.
+        '10.0.0.0/16-24')"""
+
+        formatted = []
+        for prefix, max_length in self.prefixes:
+            length = int(prefix.rpartition('/')[2])
+            if max_length is None or max_length == length:
+                formatted.append(prefix)
+            else:
+                formatted.append(f'{prefix}-{max_length}')
+
+        return formatted
+
+    def to_list(self):
+        """JSON serializable content of the ROA"""
+
+        return [self.signing_time, self.serial, self.not_before, self.not_after,
+                self.asn, [list(prefix) for prefix in self.prefixes]]
+
+    @classmethod
+    def from_list(cls, values):
+        """Create a ROA from the output of to_list()"""
+
+        *values, prefixes = values
+        return cls(*values, [tuple(prefix) for prefix in prefixes])
+
+
+def _tlv(data, offset):
+    """Read the DER element at offset. Returns its tag and the start and end
+    offsets of its value."""
+
+    tag = data[offset]
+    length = data[offset+1]
+    offset += 2
+    if length & 0x80:
+        nb_bytes = length & 0x7f
+        if nb_bytes == 0:
+            raise ValueError('indefinite length is not DER')
+        length = int.from_bytes(data[offset:offset+nb_bytes], 'big')
+        offset += nb_bytes
+
+    end = offset + length
+    if end > len(data):
+        raise ValueError('truncated DER element')
+
+    return tag, offset, end
+
+
+def _children(data, start, end):
+    """List of (tag, start, end) of the elements contained in a constructed
+    value"""
+
+    children = []
+    while start < end:
+        tag, value_start, value_end = _tlv(data, start)
+        children.append( (tag, value_start, value_end) )
+        start = value_end
+
+    return children
+
+
+def _expect(element, tag):
+    if element[0] != tag:
+        raise ValueError(f'unexpected DER tag {element[0]:#x}, expected {tag:#x}')
+
+    return element
+
+
+def _integer(data, element):
+    _, start, end = _expect(element, INTEGER)
+    return int.from_bytes(data[start:end], 'big', signed=True)
+
+
+def _time(data, element):
+    """UTCTime or GeneralizedTime as '2022-01-01T00:00:00Z'"""
+
+    tag, start, end = element
+    value = bytes(data[start:end]).decode('ascii')
+    if tag == UTC_TIME:
+        year = int(value[:2])
+        value = ('19' if year >= 50 else '20') + value
+    elif tag != GENERALIZED_TIME:
+        raise ValueError(f'unexpected DER tag {tag:#x} for a time')
+
+    return f'{value[:4]}-{value[4:6]}-{value[6:8]}T{value[8:10]}:{value[10:12]}:{value[12:14]}Z'
+
+
+def _prefix(data, element, afi):
+    """Prefix encoded as a BIT STRING"""
+
+    _, start, end = _expect(element, BIT_STRING)
+    unused_bits = data[start]
+    address = bytes(data[start+1:end])
+    length = 8*len(address) - unused_bits
+
+    if afi == AFI_IPV4:
+        network = ipaddress.IPv4Network( (address.ljust(4, b'\0'), length), strict=False )
+    else:
+        network = ipaddress.IPv6Network( (address.ljust(16, b'\0'), length), strict=False )
+
+    return str(network)
+
+
+def decode_roa(data):
+    """Decode a DER encoded ROA (RFC 6482). The signature is NOT verified.
+    Returns a ROA."""
+
+    data = memoryview(data)
+
+    # ContentInfo -> SignedData
+    content_info = _children(data, *_expect(_tlv(data, 0), SEQUENCE)[1:])
+    signed_data = _expect(_children(data, *_expect(content_info[1], CONTEXT_0)[1:])[0], SEQUENCE)
+    signed_data = _children(data, *signed_data[1:])
+
+    # EncapsulatedContentInfo -> RouteOriginAttestation
+    encap = _children(data, *_expect(signed_data[2], SEQUENCE)[1:])
+    econtent = _expect(_children(data, *_expect(encap[1], CONTEXT_0)[1:])[0], OCTET_STRING)
+    attestation = _children(data, *_expect(_tlv(data, econtent[1]), SEQUENCE)[1:])
+    if attestation[0][0] == CONTEXT_0:
+        # version
+        attestation = attestation[1:]
+    asn = _integer(data, attestation[0])
+
+    prefixes = []
+    for family in _children(data, *_expect(attestation[1], SEQUENCE)[1:]):
+        family = _children(data, *_expect(family, SEQUENCE)[1:])
+        _, start, end = _expect(family[0], OCTET_STRING)
+        afi = bytes(data[start:start+2])
+        if afi not in (AFI_IPV4, AFI_IPV6):
+            raise ValueError(f'unknown address family {afi.hex()}')
+
+        for address in _children(data, *_expect(family[1], SEQUENCE)[1:]):
+            address = _children(data, *_expect(address, SEQUENCE)[1:])
+            max_length = _integer(data, address[1]) if len(address) > 1 else None
+            prefixes.append( (_prefix(data, address[0], afi), max_length) )
+
+    # EE certificate
+    serial, not_before, not_after = None, None, None
+    signer_infos = None
+    for element in signed_data[3:]:
+        if element[0] == CONTEXT_0 and serial is None:
+            certificate = _children(data, *element[1:])[0]
+            tbs = _children(data, *_children(data, *_expect(certificate, SEQUENCE)[1:])[0][1:])
+            if tbs[0][0] == CONTEXT_0:
+                # version
+                tbs = tbs[1:]
+            serial = _integer(data, tbs[0])
+            validity = _children(data, *_expect(tbs[3], SEQUENCE)[1:])
+            not_before = _time(data, validity[0])
+            not_after = _time(data, validity[1])
+        elif element[0] == SET:
+            signer_infos = element
+
+    # signingTime attribute of the first signer
+    signing_time = None
+    if signer_infos is not None:
+        signer_info = _children(data, *_children(data, *signer_infos[1:])[0][1:])
+        for element in signer_info:
+            if element[0] != CONTEXT_0:
+                continue
+
+            for attribute in _children(data, *element[1:]):
+                attr_type, attr_values = _children(data, *attribute[1:])[:2]
+                if data[attr_type[1]:attr_type[2]] == SIGNING_TIME_OID:
+                    signing_time = _time(data, _children(data, *attr_values[1:])[0])
+
+    return ROA(signing_time, serial, not_before, not_after, asn, prefixes)
+
+
+def decode_data(data, name=''):
+    """Decode a ROA, returns None if it can't be decoded
+
+    name: file name shown in error messages
+    """
+
+    try:
+        return decode_roa(data)
+    except (ValueError, IndexError) as error:
+        print(f'Error: could not decode {name}: {error}', file=sys.stderr)
+
+    return None
+
+
+def read_roa(fname):
+    """Decode a ROA file, returns None if the file can't be decoded"""
+
+    try:
+        with open(fname, 'rb') as fp:
+            data = fp.read()
+    except OSError as error:
+        print(f'Error: could not read {fname}: {error}', file=sys.stderr)
+        return None
+
+    return decode_data(data, fname)
+
+
+def _decode_job(job):
+    roa = decode_data(*job)
+    return None if roa is None else roa.to_list()
+
+
+class ROADecoder(object):
+    def __init__(self, nb_proc=1, cache=None):
+        """Decode batches of ROA files in the current process or in a pool of
+        processes.
+
+        nb_proc: number of processes, 1 decodes files in the current process
+        cache: ObjectCache of decoded ROAs, only ROAs missing from the cache
+        are decoded
+        """
+
+        self.cache = cache
+        self.executor = None
+        if nb_proc > 1:
+            self.executor = ProcessPoolExecutor(max_workers=nb_proc)
+
+    def decode_files(self, fnames):
+        """Return the ROA of each file (None for files that can't be decoded),
+        in the same order as fnames"""
+
+        if self.cache is None:
+            if self.executor is None or len(fnames) < 2:
+                return [read_roa(fname) for fname in fnames]
+
+            return list(self.executor.map(read_roa, fnames, chunksize=64))
+
+        digests = []
+        jobs = {}
+        for fname in fnames:
+            with open(fname, 'rb') as fp:
+                data = fp.read()
+            digest = object_hash(data)
+            digests.append(digest)
+            jobs[digest] = (data, fname)
+
+        return [ None if value is None else ROA.from_list(value)
+                for value in self.decode_cached(digests, jobs) ]
+
+    def decode_cached(self, digests, jobs):
+        """Return the decoded value (see ROA.to_list) of each hash in digests,
+        ROAs missing from the cache are decoded and cached.
+
+        jobs: (DER bytes, file name) of ROAs that may be missing from the cache,
+        indexed by their hash
+        """
+
+        values = self.cache.get_many('roa', digests)
+        self.cache.touch('roa', values.keys())
+
+        missing = [ digest for digest in jobs if digest not in values ]
+        if self.executor is None or len(missing) < 2:
+            decoded = map(_decode_job, [jobs[digest] for digest in missing])
+        else:
+            decoded = self.executor.map(_decode_job, [jobs[digest] for digest in missing], chunksize=64)
+
+        new_values = dict(zip(missing, decoded))
+        self.cache.put_many('roa', new_values)
+        values.update(new_values)
+
+        return [ values[digest] for digest in digests ]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -3,16 +3,23 @@ from collections import defaultdict
 import subprocess
 import sys
 from glob import glob
+from objectcache import ObjectCache, object_hash
+from roadecoder import ROADecoder
 
 class RPKI_to_CSV():
-    def __init__(self, dumps_folder, asn):
+    def __init__(self, dumps_folder, asn, nb_proc=1, cache=None):
         """ 
         dumps_folder: folder containing afrinic, apnic, arin, lacnic, ripe subfolders
         asn: extract only timing for the given ASN. All if set to None.
+        nb_proc: number of processes decoding ROAs
+        cache: ObjectCache of decoded ROAs and CRLs, default to the user's 
+        cache
         """
 
         self.dumps_folder = dumps_folder
         self.asn = asn
+        self.cache = ObjectCache() if cache is None else cache
+        self.decoder = ROADecoder(nb_proc, self.cache)
 
 
     def convert(self):
@@ -38,24 +45,32 @@ class RPKI_to_CSV():
                     csv.write(','.join(str(x) for x in revocation.values())+',revoke\n')
 
     def read_roas(self, roas_fname):
-        txt_output = subprocess.run(
-            ["python2", "print_roa", "--list"] + roas_fname,
-            capture_output=True, text=True)
-
-        for line in txt_output.stdout.splitlines(): 
-
-            time, id, asn, prefix = line.split(" ")
+        for roa in self.decoder.decode_files(roas_fname):
+            if roa is None:
+                continue
 
+            asn = str(roa.asn)
             if self.asn is not None and asn != self.asn :
                 continue
 
-            yield {"id": int(id), "time": time, "asn": asn, "prefix": prefix}
+            for prefix in roa.formatted_prefixes():
+                yield {"id": roa.serial, "time": roa.signing_time, "asn": asn, "prefix": prefix}
+
+    def read_revocations(self, crl_fname):
+        """Return the list of (serial, revocation date) found in a CRL"""
+
+        with open(crl_fname, 'rb') as fp:
+            digest = object_hash(fp.read())
+
+        revocations = self.cache.get('crl', digest)
+        if revocations is not None:
+            return revocations
 
-    def read_crl(self, crl_fname, roa_serials, prefixes):
         txt_output = subprocess.run(
             ["openssl", "crl", "-inform", "DER", "-text", "-noout", "-in", crl_fname],
             capture_output=True, text=True)
 
+        revocations = []
         serial = None
         for line in txt_output.stdout.splitlines():
             value = line.partition(':')[2]
@@ -63,41 +78,50 @@ class RPKI_to_CSV():
                 serial = int(value, base=16)
 
             if line.strip().startswith('Revocation Date:'):
-                try:
-                    timestamp = arrow.get(value, 'MMM  D HH:mm:ss YYYY ZZZ')
-                except arrow.parser.ParserMatchError:
-                    timestamp = arrow.get(value, 'MMM DD HH:mm:ss YYYY ZZZ')
+                revocations.append( (serial, value) )
 
-                if serial in roa_serials:
+        self.cache.put('crl', digest, revocations)
 
-                    for roa_attr in roa_serials[serial]:
+        return revocations
+
+    def read_crl(self, crl_fname, roa_serials, prefixes):
+        for serial, value in self.read_revocations(crl_fname):
+            try:
+                timestamp = arrow.get(value, 'MMM  D HH:mm:ss YYYY ZZZ')
+            except arrow.parser.ParserMatchError:
+                timestamp = arrow.get(value, 'MMM DD HH:mm:ss YYYY ZZZ')
+
+            if serial in roa_serials:
+
+                for roa_attr in roa_serials[serial]:
+                    yield {
+                        'id': serial, 
+                        'time': timestamp, 
+                        'asn': roa_attr['asn'], 
+                        'prefix': roa_attr['prefix']
+                        }
+            else:
+                # APNIC overwrite ROAs when adding new prefixes
+                if prefixes:
+                    for prefix, asn in prefixes:
                         yield {
                             'id': serial, 
                             'time': timestamp, 
-                            'asn': roa_attr['asn'], 
-                            'prefix': roa_attr['prefix']
+                            'asn': asn,
+                            'prefix': prefix
                             }
-                else:
-                    # APNIC overwrite ROAs when adding new prefixes
-                    if prefixes:
-                        for prefix, asn in prefixes:
-                            yield {
-                                'id': serial, 
-                                'time': timestamp, 
-                                'asn': asn,
-                                'prefix': prefix
-                                }
 
 
-                    else:
-                        yield {
-                            'id': serial, 
-                            'time': timestamp, 
-                            'asn': 'unknown', 
-                            'prefix': 'unknown'
-                            }
+                else:
+                    yield {
+                        'id': serial, 
+                        'time': timestamp, 
+                        'asn': 'unknown', 
+                        'prefix': 'unknown'
+                        }
 
 
 if __name__ == '__main__':
     rtc = RPKI_to_CSV(sys.argv[1], sys.argv[2])
     rtc.convert()
+    rtc.decoder.close()